@@ -0,0 +1,110 @@
+"""
+Bytes read and wall time per file for the old two-pass parse (mutagen.File for
+the art, then again with easy=True for the tags) against the single pass in
+metadata_tags.read_audio_file, and the tags-only read.
+
+usage: python bench/audio_parse.py [--music-dir DIR] [--files N]
+Without --music-dir a synthetic set of FLAC/MP3 files is generated.
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import mutagen
+import mutagen.easyid3
+import mutagen.flac
+import mutagen.mp3
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import library
+from metadata_tags import Tags, read_audio_file, read_audio_tags
+
+
+def bytes_read() -> int | None:
+  # characters read by this process through read syscalls (linux only)
+  try:
+    with open('/proc/self/io') as f:
+      for line in f:
+        if line.startswith('rchar:'):
+          return int(line.split()[1])
+  except OSError:
+    return None
+
+
+def two_pass_parse(f: Path):
+  m = mutagen.File(f)
+  if isinstance(m, mutagen.flac.FLAC):
+    pics = [p.data for p in m.pictures]
+  else:
+    pics = [m.get(k).data for k in m.keys() if k.startswith('APIC:')]
+
+  concat = lambda l: ', '.join(l)
+  m = mutagen.File(f, easy=True)
+  tags = Tags()
+  if isinstance(m.tags, mutagen.flac.VCFLACDict):
+    tags.artist = concat(m.tags.get('ARTIST', []))
+    tags.title = concat(m.tags.get('TITLE', []))
+    tags.date = concat(
+      m.tags.get('originalyear') or m.tags.get('year') or m.tags.get('originaldate')
+      or m.tags.get('releasedate') or m.tags.get('date') or []
+    )
+    tags.album = concat(m.tags.get('album', []))
+  elif isinstance(m.tags, mutagen.easyid3.EasyID3):
+    tags.artist = concat(m.tags.get('artist', []))
+    tags.title = concat(m.tags.get('title', []))
+    tags.date = concat(m.tags.get('date', []) or m.tags.get('originaldate', []))
+    tags.album = concat(m.tags.get('album', []))
+  tags.title = tags.title or f.stem
+  return tags, pics[0] if pics else None
+
+
+def generate(root: Path, count: int) -> list[Path]:
+  files = []
+  for i in range(count):
+    tags = {'artist': f'Artist {i}', 'title': f'Title {i}', 'album': f'Album {i}', 'date': '2001'}
+    picture = library.image_bytes(1200, seed=i) if i % 2 == 0 else None
+    for ext, writer in (('flac', library.flac_bytes), ('mp3', library.mp3_bytes)):
+      path = root / f'{i:04}.{ext}'
+      path.write_bytes(writer(tags, picture, audio_size=4_000_000))
+      files.append(path)
+  return files
+
+
+def measure(name: str, fn, files: list[Path]):
+  results = []
+  start_bytes, start = bytes_read(), time.perf_counter()
+  for f in files:
+    results.append(fn(f))
+  wall = time.perf_counter() - start
+  end_bytes = bytes_read()
+  per_file_bytes = (end_bytes - start_bytes) / len(files) if start_bytes is not None else float('nan')
+  print(f'{name:>10}: {wall / len(files) * 1000:7.3f}ms/file  {per_file_bytes / 1024:9.1f} KiB read/file')
+  return results
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--music-dir', type=Path)
+  parser.add_argument('--files', type=int, default=100, help='synthetic files per format')
+  args = parser.parse_args()
+
+  with tempfile.TemporaryDirectory() as tmp:
+    if args.music_dir:
+      files = sorted(p for p in args.music_dir.rglob('*') if p.suffix.lower() in {'.flac', '.mp3'})
+    else:
+      files = generate(Path(tmp), args.files)
+    print(f'{len(files)} files')
+
+    old = measure('two-pass', two_pass_parse, files)
+    new = measure('one-pass', read_audio_file, files)
+    tags_only = measure('tags-only', read_audio_tags, files)
+
+    mismatches = [f for f, a, b, t in zip(files, old, new, tags_only) if a != b or a[0] != t]
+    if mismatches:
+      print(f'{len(mismatches)} files parsed differently, e.g. {mismatches[0]}')
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,104 @@
+"""
+Latency and peak RSS per cover for metadata_service.resize_and_store_image
+with COVER_RESIZE_MODE=quality (full decode + LANCZOS) and fast (JPEG draft
+decoding + COVER_FAST_RESAMPLE), for a few source image sizes. Each mode and
+size runs in a fresh subprocess so the peak RSS isn't shared between them.
+
+usage: python bench/cover_resize.py [--sizes N ...] [--covers N] [--env KEY=VALUE ...]
+"""
+import argparse
+import hashlib
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from io import BytesIO
+from pathlib import Path
+
+import library
+
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+MODES = ('quality', 'fast')
+
+
+def max_rss_kib() -> int:
+  # kilobytes on linux
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def child_main(args):
+  sys.path.insert(0, str(REPO_DIR))
+  from PIL import Image
+  import metadata_service
+  from config import COVER_DIR
+
+  COVER_DIR.mkdir(parents=True, exist_ok=True)
+  sources = [library.image_bytes(args.size, seed=i) for i in range(args.covers)]
+  baseline_rss = max_rss_kib()
+  latencies = []
+  sizes = set()
+  filenames = []
+  for data in sources:
+    start = time.perf_counter()
+    cover = metadata_service.resize_and_store_image(Image.open(BytesIO(data)), hashlib.sha256(data).hexdigest())
+    latencies.append(time.perf_counter() - start)
+    sizes.add((cover.width, cover.height))
+    filenames.append(cover.filename)
+    # so the next cover isn't skipped because its file already exists
+    (COVER_DIR / cover.filename).unlink()
+  print(json.dumps({
+    'mean_ms': statistics.fmean(latencies) * 1000,
+    'p50_ms': statistics.median(latencies) * 1000,
+    'max_ms': max(latencies) * 1000,
+    'peak_rss_delta_mib': (max_rss_kib() - baseline_rss) / 1024,
+    'sizes': sorted(sizes),
+    'filenames': filenames,
+  }))
+
+
+def run_child(mode: str, size: int, args) -> dict:
+  with tempfile.TemporaryDirectory(prefix=f'bench-cover-{mode}-') as tmp:
+    env = {
+      **os.environ,
+      'COVER_RESIZE_MODE': mode,
+      'COVER_DIR': str(Path(tmp) / 'cover'),
+      **dict(kv.split('=', 1) for kv in args.env),
+    }
+    cmd = [sys.executable, str(Path(__file__).resolve()), '--child', '--size', str(size), '--covers', str(args.covers)]
+    proc = subprocess.run(cmd, env=env, cwd=tmp, stdout=subprocess.PIPE, text=True, check=True)
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 2000, 4000], help='source image sizes')
+  parser.add_argument('--covers', type=int, default=10, help='covers resized per mode and size')
+  parser.add_argument('--env', action='append', default=[], help='KEY=VALUE passed to the config')
+  parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+  parser.add_argument('--size', type=int, help=argparse.SUPPRESS)
+  args = parser.parse_args()
+
+  if args.child:
+    return child_main(args)
+
+  print(f'{'source':>7} {'mode':>8} {'mean':>9} {'p50':>9} {'max':>9} {'peak rss':>10}  cover sizes')
+  for size in args.sizes:
+    reports = {mode: run_child(mode, size, args) for mode in MODES}
+    for mode, report in reports.items():
+      print(
+        f'{size:>7} {mode:>8} {report['mean_ms']:>7.1f}ms {report['p50_ms']:>7.1f}ms {report['max_ms']:>7.1f}ms'
+        f' {report['peak_rss_delta_mib']:>6.1f} MiB  {report['sizes']}'
+      )
+    if reports['quality']['sizes'] != reports['fast']['sizes']:
+      print(f'cover sizes differ between modes for {size}px sources')
+    if reports['quality']['filenames'] != reports['fast']['filenames']:
+      print(f'cover filenames differ between modes for {size}px sources')
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,166 @@
+"""
+Requests/s of server.py run as a real server with different HTTP_WORKERS
+counts. For each count the server is started in its own process against the
+same synthetic library, the caches are warmed, then several client processes
+request every file for a number of passes. Mostly measures the http side
+(rendered page cache hits and hub round trips), which is what the extra
+workers spread across cores.
+
+usage: python bench/http_workers.py [--workers N ...] [--scale N] [--passes N]
+  [--clients N] [--concurrency N] [--env KEY=VALUE ...] [--output FILE]
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import library
+from server_bench import REPO_DIR, fetch_all, git_revision, summarise
+
+
+def free_port() -> int:
+  with socket.socket() as sock:
+    sock.bind(('127.0.0.1', 0))
+    return sock.getsockname()[1]
+
+
+async def wait_until_ready(base_url: str, path: str, timeout: float):
+  # the first file answers once the workers are up and the index has it
+  import aiohttp
+
+  deadline = time.monotonic() + timeout
+  async with aiohttp.ClientSession() as session:
+    while time.monotonic() < deadline:
+      try:
+        async with session.get(f'{base_url}/{path}') as resp:
+          if resp.status == 200:
+            return
+      except aiohttp.ClientError:
+        pass
+      await asyncio.sleep(0.1)
+  raise RuntimeError('server did not become ready')
+
+
+def client_main(base_url: str, paths: list[str], concurrency: int):
+  return asyncio.run(fetch_all(base_url, paths, concurrency))[0]
+
+
+def run_clients(base_url: str, paths: list[str], clients: int, concurrency: int) -> dict:
+  # one client process can't saturate several server processes
+  chunks = [paths[i::clients] for i in range(clients)]
+  with multiprocessing.get_context('fork').Pool(clients) as pool:
+    start = time.perf_counter()
+    results = pool.starmap(client_main, [(base_url, chunk, concurrency) for chunk in chunks])
+    wall = time.perf_counter() - start
+  return summarise([r for chunk in results for r in chunk], wall)
+
+
+def run_server(workers: int, work_dir: Path, paths: list[str], args) -> dict:
+  port = free_port()
+  base_url = f'http://localhost:{port}'
+  env = {
+    **os.environ,
+    'PORT': str(port),
+    'HTTP_WORKERS': str(workers),
+    'MUSIC_DIR': str(work_dir / 'music'),
+    'COVER_DIR': str(work_dir / 'cover'),
+    'DEFAULT_COVER_PATH': str(REPO_DIR / 'default.png'),
+    'WARMER_RATE': '0',
+    **dict(kv.split('=', 1) for kv in args.env),
+  }
+  # a fresh cache db, hub socket and index snapshot for every run
+  run_dir = work_dir / f'workers-{workers}'
+  run_dir.mkdir()
+  proc = subprocess.Popen(
+    [sys.executable, str(REPO_DIR / 'server.py')], env=env, cwd=run_dir,
+    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+  )
+  try:
+    asyncio.run(wait_until_ready(base_url, paths[0], timeout=60))
+    pending = paths
+    start = time.perf_counter()
+    while pending:
+      results, _ = asyncio.run(fetch_all(base_url, pending, args.concurrency))
+      if any(r.status >= 400 for r in results):
+        raise RuntimeError('errors while warming the cache')
+      pending = [p for p, r in zip(pending, results) if r.incomplete]
+    prewarm = time.perf_counter() - start
+
+    requests = [p for _ in range(args.passes) for p in paths]
+    random.Random(workers).shuffle(requests)
+    report = run_clients(base_url, requests, args.clients, args.concurrency)
+    report['prewarm_s'] = prewarm
+    return report
+  finally:
+    proc.send_signal(signal.SIGTERM)
+    try:
+      proc.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+      proc.kill()
+      proc.wait()
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--workers', type=int, action='append', help='HTTP_WORKERS values to run (default: 1, 2, 4...)')
+  parser.add_argument('--scale', type=int, default=1, help='multiplier for the library size')
+  parser.add_argument('--passes', type=int, default=10, help='times each file is requested')
+  parser.add_argument('--clients', type=int, default=4, help='client processes')
+  parser.add_argument('--concurrency', type=int, default=16, help='connections per client process')
+  parser.add_argument('--env', action='append', default=[], help='KEY=VALUE passed to the server config')
+  parser.add_argument('--output', type=Path, help='write the results as JSON')
+  args = parser.parse_args()
+
+  cpus = os.cpu_count() or 1
+  worker_counts = args.workers or [n for n in (1, 2, 4, 8, 16) if n <= cpus] or [1]
+  results = {
+    'revision': git_revision(),
+    'timestamp': time.time(),
+    'python': platform.python_version(),
+    'cpus': cpus,
+    'scale': args.scale,
+    'passes': args.passes,
+    'clients': args.clients,
+    'concurrency': args.concurrency,
+    'env': args.env,
+    'workers': {},
+  }
+
+  with tempfile.TemporaryDirectory(prefix='bench-http-workers-') as tmp:
+    work_dir = Path(tmp)
+    spec = library.LibrarySpec(albums=20 * args.scale, tracks_per_album=10)
+    paths = library.generate_library(work_dir / 'music', spec)
+
+    baseline = None
+    print(f'{'workers':>7} {'reqs':>7} {'req/s':>8} {'speedup':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'errors':>6}')
+    for workers in worker_counts:
+      try:
+        report = run_server(workers, work_dir, paths, args)
+      except RuntimeError as e:
+        results['workers'][workers] = {'failed': True, 'error': str(e)}
+        print(f'{workers:>7} failed: {e}')
+        continue
+      results['workers'][workers] = report
+      baseline = baseline or report['throughput_rps']
+      print(
+        f'{workers:>7} {report['requests']:>7} {report['throughput_rps']:>8.1f}'
+        f' {report['throughput_rps'] / baseline:>6.2f}x {report['p50_ms']:>6.1f}ms'
+        f' {report['p95_ms']:>6.1f}ms {report['p99_ms']:>6.1f}ms {report['errors']:>6}'
+      )
+
+  if args.output:
+    args.output.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+  main()
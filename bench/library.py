@@ -0,0 +1,149 @@
+"""
+Writers for synthetic FLAC/MP3 files and cover images, and a generator for
+whole synthetic libraries, so the benchmarks can run without real music.
+
+usage: python bench/library.py OUT_DIR [--albums N] [--tracks N] [--depth N] ...
+"""
+import argparse
+import io
+import random
+from dataclasses import dataclass
+from pathlib import Path
+
+import mutagen.flac
+import mutagen.id3
+from PIL import Image
+
+
+FLAC_STREAMINFO = 0
+FLAC_VORBIS_COMMENT = 4
+FLAC_PICTURE = 6
+# MPEG-1 layer III, 128 kbit/s, 44.1 kHz, joint stereo, 417 bytes per frame
+MP3_FRAME_HEADER = bytes([0xff, 0xfb, 0x90, 0x64])
+MP3_FRAME_SIZE = 417
+
+
+def image_bytes(size: int, seed: int, format='JPEG') -> bytes:
+  # a few random blocks of colour, so each seed gives different image data
+  rng = random.Random(seed)
+  im = Image.new('RGB', (size, size), tuple(rng.randrange(256) for _ in range(3)))
+  for _ in range(8):
+    x, y = rng.randrange(size), rng.randrange(size)
+    block = Image.new('RGB', (size // 4, size // 4), tuple(rng.randrange(256) for _ in range(3)))
+    im.paste(block, (x, y))
+  data = io.BytesIO()
+  im.save(data, format=format, quality=90)
+  return data.getvalue()
+
+
+def _flac_streaminfo(total_samples: int) -> bytes:
+  block_size = (4096).to_bytes(2, 'big') * 2
+  frame_size = b'\0\0\0' * 2
+  # 44.1 kHz, 2 channels, 16 bits per sample
+  packed = (44100 << 44) | (1 << 41) | (15 << 36) | total_samples
+  return block_size + frame_size + packed.to_bytes(8, 'big') + bytes(16)
+
+
+def flac_bytes(tags: dict[str, str], picture: bytes | None = None, audio_size=0) -> bytes:
+  comment = mutagen.flac.VCFLACDict()
+  for key, value in tags.items():
+    comment[key] = value
+  blocks = [
+    (FLAC_STREAMINFO, _flac_streaminfo(audio_size // 4)),
+    (FLAC_VORBIS_COMMENT, comment.write(framing=False)),
+  ]
+  if picture:
+    pic = mutagen.flac.Picture()
+    pic.type = 3
+    pic.mime = 'image/jpeg'
+    pic.data = picture
+    blocks.append((FLAC_PICTURE, pic.write()))
+
+  out = bytearray(b'fLaC')
+  for i, (block_type, data) in enumerate(blocks):
+    is_last = 0x80 if i == len(blocks) - 1 else 0
+    out += bytes([is_last | block_type]) + len(data).to_bytes(3, 'big') + data
+  # stand-in for the audio frames, never decoded by the service
+  out += bytes(audio_size)
+  return bytes(out)
+
+
+def mp3_bytes(tags: dict[str, str], picture: bytes | None = None, audio_size=0) -> bytes:
+  id3 = mutagen.id3.ID3()
+  frames = {'artist': mutagen.id3.TPE1, 'title': mutagen.id3.TIT2, 'album': mutagen.id3.TALB, 'date': mutagen.id3.TDRC}
+  for key, value in tags.items():
+    id3.add(frames[key](encoding=3, text=[value]))
+  if picture:
+    id3.add(mutagen.id3.APIC(encoding=3, mime='image/jpeg', type=3, desc='', data=picture))
+  tag = io.BytesIO()
+  id3.save(tag, v2_version=4, padding=lambda info: 0)
+
+  frame = MP3_FRAME_HEADER + bytes(MP3_FRAME_SIZE - len(MP3_FRAME_HEADER))
+  frame_count = max(8, audio_size // MP3_FRAME_SIZE)
+  return tag.getvalue() + frame * frame_count
+
+
+@dataclass(kw_only=True)
+class LibrarySpec:
+  albums: int = 20
+  tracks_per_album: int = 10
+  # directory levels above each album (e.g. genre/artist/album for 2)
+  depth: int = 1
+  # fraction of albums whose tracks have embedded art, and with a folder image
+  embedded_art: float = 0.5
+  folder_art: float = 0.5
+  # fraction of tracks that get their own art instead of the album's
+  unique_art: float = 0.0
+  art_size: int = 1000
+  mp3_ratio: float = 0.5
+  audio_size: int = 0
+  seed: int = 0
+
+
+def generate_library(root: Path, spec: LibrarySpec) -> list[str]:
+  # returns the relative paths of the generated audio files
+  rng = random.Random(spec.seed)
+  paths: list[str] = []
+  for album in range(spec.albums):
+    parents = [f'level{level}-{rng.randrange(max(1, spec.albums // 4))}' for level in range(spec.depth)]
+    album_dir = root.joinpath(*parents, f'Album {album:05}')
+    album_dir.mkdir(parents=True, exist_ok=True)
+
+    album_art = image_bytes(spec.art_size, seed=spec.seed * 1_000_003 + album)
+    has_embedded_art = rng.random() < spec.embedded_art
+    if rng.random() < spec.folder_art:
+      (album_dir / 'cover.jpg').write_bytes(album_art)
+
+    for track in range(spec.tracks_per_album):
+      picture = None
+      if has_embedded_art:
+        unique = rng.random() < spec.unique_art
+        picture = image_bytes(spec.art_size, seed=rng.randrange(1 << 30)) if unique else album_art
+      tags = {
+        'artist': f'Artist {album % 97}',
+        'title': f'Track {track:02} of album {album}',
+        'album': f'Album {album:05}',
+        'date': str(1970 + album % 50),
+      }
+      is_mp3 = rng.random() < spec.mp3_ratio
+      writer = mp3_bytes if is_mp3 else flac_bytes
+      path = album_dir / f'{track:02} - Track {track:02}.{'mp3' if is_mp3 else 'flac'}'
+      path.write_bytes(writer(tags, picture, audio_size=spec.audio_size))
+      paths.append(str(path.relative_to(root)))
+  return paths
+
+
+def main():
+  defaults = LibrarySpec()
+  parser = argparse.ArgumentParser()
+  parser.add_argument('out_dir', type=Path)
+  for name, value in vars(defaults).items():
+    parser.add_argument(f'--{name.replace('_', '-')}', type=type(value), default=value)
+  args = vars(parser.parse_args())
+  out_dir = args.pop('out_dir')
+  paths = generate_library(out_dir, LibrarySpec(**args))
+  print(f'generated {len(paths)} files in {out_dir}')
+
+
+if __name__ == '__main__':
+  main()
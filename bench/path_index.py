@@ -0,0 +1,134 @@
+"""
+Memory and lookup time of the file index: a plain set of relative paths (what
+file_indexer used to keep) against path_index.PathIndex, for synthetic
+libraries laid out as artist/album/track. Each structure and size is built in
+a fresh subprocess and measured by the growth of its resident memory. Also
+the peak extra memory (tracemalloc) of saving and loading the index snapshot:
+file_indexer's for PathIndex, the join and split of every path the snapshot
+used to do for the set.
+
+usage: python bench/path_index.py [--paths N ...] [--lookups N]
+"""
+import argparse
+import json
+import random
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from path_index import PathIndex
+
+
+STRUCTURES = ('set', 'PathIndex')
+TRACKS_PER_ALBUM = 12
+ALBUMS_PER_ARTIST = 5
+
+
+def make_path(i: int) -> str:
+  album = i // TRACKS_PER_ALBUM
+  artist = album // ALBUMS_PER_ARTIST
+  return (
+    f'Some Artist Name {artist:07}/{1970 + album % 50} - An Album Title {album:07}'
+    f'/{i % TRACKS_PER_ALBUM + 1:02} - A Track Title Of Average Length {i:08}.flac'
+  )
+
+
+def rss_bytes() -> int:
+  # current resident set size (linux only)
+  with open('/proc/self/statm') as f:
+    return int(f.read().split()[1]) * 4096
+
+
+def peak_memory(fn) -> int:
+  # bytes allocated by fn on top of what was there before it ran
+  tracemalloc.start()
+  try:
+    fn()
+    return tracemalloc.get_traced_memory()[1]
+  finally:
+    tracemalloc.stop()
+
+
+def snapshot_memory(index, tmp: str) -> tuple[int, int]:
+  if isinstance(index, set):
+    snapshot_path = Path(tmp) / 'snapshot'
+    def save():
+      snapshot_path.write_bytes('\0'.join(index).encode())
+    def load():
+      set(snapshot_path.read_bytes().decode().split('\0'))
+    return peak_memory(save), peak_memory(load)
+
+  os.environ['INDEX_SNAPSHOT_PATH'] = str(Path(tmp) / 'snapshot')
+  import file_indexer
+  file_indexer.discovered_files = index
+  file_indexer.discovered_dirs = {relative_dir: 0 for relative_dir, _ in index.iter_dirs()}
+  save = peak_memory(file_indexer._save_snapshot)
+  # drop the index first, like an http worker replacing it with the new snapshot
+  file_indexer.discovered_files = file_indexer.discovered_dirs = None
+  del index
+  load = peak_memory(file_indexer.load_snapshot)
+  if len(file_indexer.discovered_files) == 0:
+    sys.exit('snapshot did not load')
+  return save, load
+
+
+def child_main(args):
+  paths = (make_path(i) for i in range(args.count))
+  before = rss_bytes()
+  start = time.perf_counter()
+  index = set(paths) if args.structure == 'set' else PathIndex.from_paths(paths)
+  build = time.perf_counter() - start
+  memory = rss_bytes() - before
+
+  rng = random.Random(0)
+  hits = [make_path(rng.randrange(args.count)) for _ in range(args.lookups)]
+  misses = [path.replace('.flac', '.mp3') for path in hits]
+  timings = {}
+  for name, queries in (('hit', hits), ('miss', misses)):
+    start = time.perf_counter()
+    found = sum(path in index for path in queries)
+    timings[name] = (time.perf_counter() - start) / len(queries)
+    if found != (len(queries) if name == 'hit' else 0):
+      sys.exit(f'wrong lookup results for {name}')
+  with tempfile.TemporaryDirectory(prefix='bench-path-index-') as tmp:
+    save, load = snapshot_memory(index, tmp)
+  print(json.dumps({'memory': memory, 'build': build, **timings, 'save': save, 'load': load}))
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--paths', type=int, nargs='+', default=[1_000_000, 5_000_000])
+  parser.add_argument('--lookups', type=int, default=200_000)
+  parser.add_argument('--child', help=argparse.SUPPRESS)
+  parser.add_argument('--count', type=int, help=argparse.SUPPRESS)
+  args = parser.parse_args()
+
+  if args.child:
+    args.structure = args.child
+    return child_main(args)
+
+  print(
+    f'{'paths':>9} {'structure':>10} {'memory':>10} {'bytes/path':>10} {'build':>8} {'hit':>9} {'miss':>9}'
+    f' {'save peak':>10} {'load peak':>10}'
+  )
+  for count in args.paths:
+    for structure in STRUCTURES:
+      cmd = [
+        sys.executable, str(Path(__file__).resolve()), '--child', structure,
+        '--count', str(count), '--lookups', str(args.lookups),
+      ]
+      report = json.loads(subprocess.run(cmd, stdout=subprocess.PIPE, text=True, check=True).stdout)
+      print(
+        f'{count:>9} {structure:>10} {report['memory'] / 2**20:>6.0f} MiB {report['memory'] / count:>10.0f}'
+        f' {report['build']:>7.2f}s {report['hit'] * 1e9:>7.0f}ns {report['miss'] * 1e9:>7.0f}ns'
+        f' {report['save'] / 2**20:>6.0f} MiB {report['load'] / 2**20:>6.0f} MiB'
+      )
+
+
+if __name__ == '__main__':
+  main()
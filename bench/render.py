@@ -0,0 +1,77 @@
+"""
+Embed page rendering: the string.Formatter renderer (templates.get_html, plus
+the text round trip uuid_middleware used to do) against the compiled template
+rendering straight to bytes. Also checks both give identical output.
+
+usage: python bench/render.py [--iterations N]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+# importing templates opens the cache db in the working directory
+_work_dir = tempfile.TemporaryDirectory()
+os.chdir(_work_dir.name)
+import templates
+from metadata_service import AudioMetadata
+from metadata_tags import Tags
+
+
+SAMPLES = [
+  AudioMetadata(
+    path='Artist/Album/01 - Title.flac', cover_filename='a.jpg', cover_width=512, cover_height=512,
+    tags=Tags(artist='Artist', title='Title', album='Album', date='2001'),
+  ),
+  AudioMetadata(
+    path='x.mp3', cover_filename='b.jpg', cover_width=512, cover_height=384,
+    tags=Tags(title='Only <a> "title" & nothing else'),
+  ),
+  AudioMetadata(
+    path='long.flac', cover_filename='c.jpg', cover_width=300, cover_height=512,
+    tags=Tags(artist='Ärtist ' * 40, title='Tïtle ' * 40, album='Ålbum ' * 40, date='1999-01-01'),
+  ),
+]
+ARGS = dict(
+  content_url='https://example.com/Artist/Album/01%20-%20Title.flac',
+  cover_url='https://example.com/cover/a.jpg',
+  gmt_now='Sun, 18 Oct 2026 10:00:00 GMT',
+)
+
+
+def old_render(meta: AudioMetadata) -> bytes:
+  # get_html then the middleware decoding and re-encoding the body for %UUID%
+  body = templates.get_html(meta=meta, **ARGS).encode()
+  return body.decode().replace('%UUID%', str(uuid.uuid4())).encode()
+
+
+def new_render(meta: AudioMetadata) -> bytes:
+  body = templates.render_html(meta=meta, **ARGS)
+  if b'%UUID%' in body:
+    body = body.replace(b'%UUID%', str(uuid.uuid4()).encode())
+  return body
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--iterations', type=int, default=20000)
+  args = parser.parse_args()
+
+  for meta in SAMPLES:
+    if templates.get_html(meta=meta, **ARGS).encode() != templates.render_html(meta=meta, **ARGS):
+      sys.exit(f'outputs differ for {meta.path}')
+  print('outputs are identical')
+
+  for name, fn in (('formatter', old_render), ('compiled', new_render)):
+    per_call = min(timeit.repeat(
+      lambda: [fn(meta) for meta in SAMPLES], number=args.iterations // len(SAMPLES), repeat=5
+    )) / (args.iterations // len(SAMPLES) * len(SAMPLES))
+    print(f'{name:>10}: {per_call * 1e6:7.2f}us/render')
+
+
+if __name__ == '__main__':
+  main()
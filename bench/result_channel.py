@@ -0,0 +1,128 @@
+"""
+Compares the cost of publishing partial metadata results from pool workers
+through a multiprocessing manager proxy (the old ResultWrapper) against the
+one-way SimpleQueue used by metadata_service.
+
+usage: python bench/result_channel.py [--workers N] [--jobs N] [--sets N]
+"""
+import argparse
+import concurrent.futures
+import multiprocessing
+import multiprocessing.queues
+import threading
+import time
+from dataclasses import dataclass, field
+from multiprocessing.managers import BaseManager
+
+
+@dataclass(kw_only=True)
+class Tags:
+  artist: str = 'Some Artist'
+  title: str = 'Some Title That Is Moderately Long'
+  album: str = 'Some Album'
+  date: str = '2001'
+
+
+@dataclass(kw_only=True)
+class Metadata:
+  path: str = 'Some Artist/Some Album/01 - Some Title That Is Moderately Long.flac'
+  mtime: int | None = None
+  cover_filename: str = 'e2c772b1914e42cbf504a7e35e9c11e26657dcc53328129d8cc21afc5dda1575.jpg'
+  tags: Tags = field(default_factory=Tags)
+  cover_width: int = 512
+  cover_height: int = 512
+  is_complete: bool = False
+
+
+@dataclass
+class ResultWrapper:
+  _result: Metadata | None = None
+
+  def set(self, value: Metadata):
+    self._result = value
+
+  def get(self) -> Metadata | None:
+    return self._result
+
+
+class MpManager(BaseManager):
+  pass
+
+
+def _init_queue(queue):
+  global result_queue
+  result_queue = queue
+
+
+def _job_proxy(res, sets: int):
+  metadata = Metadata()
+  start = time.perf_counter()
+  for _ in range(sets):
+    res.set(metadata)
+  return time.perf_counter() - start
+
+
+def _job_queue(job_id: int, sets: int):
+  metadata = Metadata()
+  start = time.perf_counter()
+  for _ in range(sets):
+    result_queue.put((job_id, metadata))
+  return time.perf_counter() - start
+
+
+def _report(name: str, wall: float, set_times: list[float], total_sets: int):
+  per_set = sum(set_times) / total_sets
+  print(f'{name:>6}: wall={wall * 1000:8.1f}ms  per set={per_set * 1e6:7.1f}us  sets/s={total_sets / wall:10.0f}')
+
+
+def bench_proxy(workers: int, jobs: int, sets: int):
+  MpManager.register('ResultWrapper', ResultWrapper)
+  with MpManager() as manager, concurrent.futures.ProcessPoolExecutor(workers) as pool:
+    wrappers = [manager.ResultWrapper() for _ in range(jobs)]
+    # warm up the pool
+    list(pool.map(abs, range(workers)))
+    start = time.perf_counter()
+    futures = [pool.submit(_job_proxy, res, sets) for res in wrappers]
+    set_times = [f.result() for f in futures]
+    wall = time.perf_counter() - start
+    assert all(res.get() is not None for res in wrappers)
+  _report('proxy', wall, set_times, jobs * sets)
+
+
+def bench_queue(workers: int, jobs: int, sets: int):
+  queue = multiprocessing.SimpleQueue()
+  results: dict[int, Metadata] = {}
+
+  def read_results():
+    while (item := queue.get()) is not None:
+      job_id, metadata = item
+      results[job_id] = metadata
+
+  reader = threading.Thread(target=read_results, daemon=True)
+  reader.start()
+  with concurrent.futures.ProcessPoolExecutor(workers, initializer=_init_queue, initargs=(queue,)) as pool:
+    list(pool.map(abs, range(workers)))
+    start = time.perf_counter()
+    futures = [pool.submit(_job_queue, job_id, sets) for job_id in range(jobs)]
+    set_times = [f.result() for f in futures]
+    wall = time.perf_counter() - start
+  queue.put(None)
+  reader.join()
+  assert len(results) == jobs
+  _report('queue', wall, set_times, jobs * sets)
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--workers', type=int, default=4)
+  parser.add_argument('--jobs', type=int, default=2000)
+  parser.add_argument('--sets', type=int, default=5, help='partial results published per job')
+  args = parser.parse_args()
+
+  print(f'workers={args.workers} jobs={args.jobs} sets/job={args.sets}')
+  bench_proxy(args.workers, args.jobs, args.sets)
+  bench_queue(args.workers, args.jobs, args.sets)
+
+
+if __name__ == '__main__':
+  main()
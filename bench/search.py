@@ -0,0 +1,94 @@
+"""
+Tag search over a synthetic cache db: time per row to write audio_files rows
+in batches with and without the full text index triggers, and latency of
+prefix queries against the filled index.
+
+usage: python bench/search.py [--rows N] [--queries N]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+# importing db opens the cache db in the working directory
+_work_dir = tempfile.TemporaryDirectory()
+os.chdir(_work_dir.name)
+import db
+from db import CachedAudioMetadata
+from metadata_tags import Tags
+
+
+WORDS = [
+  'love', 'night', 'blue', 'dream', 'fire', 'heart', 'river', 'sky', 'summer', 'ghost', 'city', 'light',
+  'dance', 'rain', 'gold', 'echo', 'wild', 'silver', 'moon', 'storm', 'Beyoncé', 'Sigur', 'Rós', 'Ænima',
+]
+
+
+def make_rows(count: int, rng: random.Random) -> list[CachedAudioMetadata]:
+  def phrase(n):
+    return ' '.join(rng.choice(WORDS) + str(rng.randrange(500)) if rng.random() < 0.3 else rng.choice(WORDS) for _ in range(n))
+  return [
+    CachedAudioMetadata(
+      path=f'artist {i % 5000}/album {i // 10}/{i:07}.flac',
+      tags=Tags(artist=phrase(2), title=phrase(3), album=phrase(2), date=str(1970 + i % 50)),
+    )
+    for i in range(count)
+  ]
+
+
+def write_rows(rows: list[CachedAudioMetadata]) -> float:
+  start = time.perf_counter()
+  for i in range(0, len(rows), db.DB_WRITE_BATCH_SIZE):
+    for meta in rows[i:i + db.DB_WRITE_BATCH_SIZE]:
+      db.store_audio_metadata(meta)
+    db.flush()
+  return (time.perf_counter() - start) / len(rows)
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--rows', type=int, default=400_000)
+  parser.add_argument('--queries', type=int, default=200)
+  args = parser.parse_args()
+  rng = random.Random(0)
+  rows = make_rows(args.rows, rng)
+
+  conn = db.get_connection()
+  triggers = [name for name, in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")]
+  with conn:
+    for name in triggers:
+      conn.execute(f'DROP TRIGGER {name}')
+  sample = rows[:min(len(rows), 20_000)]
+  print(f'without index: {write_rows(sample) * 1e6:7.1f}us/row')
+  with conn:
+    conn.execute('DELETE FROM audio_files')
+    for statement in db.SEARCH_SCHEMA:
+      conn.execute(statement)
+    conn.execute("INSERT INTO audio_files_fts(audio_files_fts) VALUES ('rebuild')")
+  print(f'   with index: {write_rows(rows) * 1e6:7.1f}us/row ({len(rows)} rows)')
+
+  for name, make_query in (
+    ('1 word prefix', lambda: rng.choice(WORDS)[:rng.randrange(2, 5)]),
+    ('2 word prefix', lambda: f'{rng.choice(WORDS)} {rng.choice(WORDS)[:3]}'),
+    ('full words', lambda: ' '.join(rng.choice(WORDS) for _ in range(3))),
+  ):
+    latencies = []
+    for _ in range(args.queries):
+      query = make_query()
+      start = time.perf_counter()
+      db.search_audio_metadata(query, limit=50)
+      latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    print(
+      f'{name:>14}: p50 {statistics.median(latencies) * 1000:6.2f}ms'
+      f'  p95 {latencies[int(len(latencies) * 0.95)] * 1000:6.2f}ms  max {latencies[-1] * 1000:6.2f}ms'
+    )
+
+
+if __name__ == '__main__':
+  main()
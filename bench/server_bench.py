@@ -0,0 +1,299 @@
+"""
+Drives the aiohttp app from server.py in-process with concurrent clients
+against a synthetic library and reports latency percentiles and throughput
+for a few scenarios:
+
+  cold         every file requested once against an empty cache
+  warm         the same requests once the metadata cache has been filled
+  warm-pool    warm, with the in-memory metadata cache disabled so every
+               request takes a pool job
+  cover-heavy  cold requests where every file has its own large embedded art
+  scan-heavy   a deep tree with requests for files added after the scan
+
+Each scenario runs in a fresh subprocess (config is read from the environment
+at import time) with its own cache db, cover dir and library. Results are
+printed as a table and written as JSON with --output.
+
+usage: python bench/server_bench.py [--scenario NAME ...] [--scale N]
+  [--concurrency N] [--env KEY=VALUE ...] [--output FILE]
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+import library
+
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+
+@dataclass(kw_only=True)
+class Scenario:
+  name: str
+  library: library.LibrarySpec
+  # fill the metadata cache before measuring
+  prewarm: bool = False
+  # times each file is requested in the measured run
+  passes: int = 1
+  # fraction of requests for files created after the initial scan
+  unindexed: float = 0.0
+  env: dict[str, str] = field(default_factory=dict)
+
+
+def make_scenarios(scale: int) -> dict[str, Scenario]:
+  return {s.name: s for s in [
+    Scenario(
+      name='cold',
+      library=library.LibrarySpec(albums=20 * scale, tracks_per_album=10),
+    ),
+    Scenario(
+      name='warm',
+      library=library.LibrarySpec(albums=20 * scale, tracks_per_album=10),
+      prewarm=True,
+      passes=3,
+      # measure the metadata cache, not the rendered page cache
+      env={'EMBED_CACHE_SIZE': '0'},
+    ),
+    Scenario(
+      name='warm-pool',
+      library=library.LibrarySpec(albums=20 * scale, tracks_per_album=10),
+      prewarm=True,
+      passes=3,
+      # warm, but every hit goes through a pool job like before the in-memory cache
+      env={'EMBED_CACHE_SIZE': '0', 'METADATA_CACHE_SIZE': '0'},
+    ),
+    Scenario(
+      name='cover-heavy',
+      library=library.LibrarySpec(
+        albums=10 * scale, tracks_per_album=10, embedded_art=1.0, folder_art=0.0,
+        unique_art=1.0, art_size=2000,
+      ),
+    ),
+    Scenario(
+      name='scan-heavy',
+      library=library.LibrarySpec(
+        albums=200 * scale, tracks_per_album=2, depth=4, embedded_art=0.0, folder_art=0.0,
+      ),
+      unindexed=0.1,
+      env={'INDEX_WATCH': 'off'},
+    ),
+  ]}
+
+
+@dataclass(kw_only=True)
+class RequestResult:
+  latency: float
+  status: int
+  # served with the short-lived placeholder headers (metadata wasn't ready)
+  incomplete: bool
+
+
+def percentile(values: list[float], p: float) -> float:
+  if not values:
+    return float('nan')
+  values = sorted(values)
+  return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def summarise(results: list[RequestResult], wall: float) -> dict:
+  latencies = [r.latency * 1000 for r in results]
+  return {
+    'requests': len(results),
+    'wall_s': wall,
+    'throughput_rps': len(results) / wall if wall else 0,
+    'p50_ms': percentile(latencies, 50),
+    'p95_ms': percentile(latencies, 95),
+    'p99_ms': percentile(latencies, 99),
+    'mean_ms': statistics.fmean(latencies) if latencies else float('nan'),
+    'max_ms': max(latencies, default=float('nan')),
+    'incomplete': sum(r.incomplete for r in results),
+    'errors': sum(r.status >= 400 or r.status == 0 for r in results),
+  }
+
+
+async def fetch_all(base_url: str, paths: list[str], concurrency: int) -> tuple[list[RequestResult], float]:
+  import aiohttp
+  from yarl import URL
+
+  results: list[RequestResult] = []
+  queue = iter(paths)
+
+  async def client(session: aiohttp.ClientSession):
+    for path in queue:
+      start = time.perf_counter()
+      try:
+        async with session.get(URL(base_url + '/' + path)) as resp:
+          await resp.read()
+          status, incomplete = resp.status, resp.headers.get('Cache-Control') == 'max-age=5'
+      except aiohttp.ClientError:
+        status, incomplete = 0, False
+      results.append(RequestResult(latency=time.perf_counter() - start, status=status, incomplete=incomplete))
+
+  connector = aiohttp.TCPConnector(limit=concurrency)
+  async with aiohttp.ClientSession(connector=connector) as session:
+    start = time.perf_counter()
+    await asyncio.gather(*(client(session) for _ in range(concurrency)))
+    wall = time.perf_counter() - start
+  return results, wall
+
+
+async def run_scenario(scenario: Scenario, concurrency: int) -> dict:
+  # runs inside the scenario subprocess, with the environment already set up
+  import db
+  import file_indexer
+  import metadata_service
+  import server
+  from aiohttp import web
+
+  music_dir = Path(os.environ['MUSIC_DIR'])
+  rng = random.Random(scenario.library.seed)
+  paths = library.generate_library(music_dir, scenario.library)
+
+  runner = web.AppRunner(server.create_app(), access_log=None)
+  await runner.setup()
+  site = web.TCPSite(runner, host='127.0.0.1', port=0)
+  await site.start()
+  port = site._server.sockets[0].getsockname()[1]
+  base_url = f'http://127.0.0.1:{port}'
+
+  start = time.perf_counter()
+  if not await file_indexer.scan_music_dir():
+    raise RuntimeError('scanning the music directory failed')
+  report = {'scan_s': time.perf_counter() - start, 'files': len(paths)}
+
+  if scenario.prewarm:
+    start = time.perf_counter()
+    pending = paths
+    while pending:
+      results, _ = await fetch_all(base_url, pending, concurrency)
+      if any(r.status >= 400 for r in results):
+        raise RuntimeError('errors while warming the cache')
+      pending = [p for p, r in zip(pending, results) if r.incomplete]
+    # workers write their results to the db in the background
+    while not set(paths) <= db.get_cached_paths():
+      await asyncio.sleep(0.05)
+    report['prewarm_s'] = time.perf_counter() - start
+
+  requests = [p for _ in range(scenario.passes) for p in paths]
+  unindexed = int(len(requests) * scenario.unindexed)
+  if unindexed:
+    spec = library.LibrarySpec(**{
+      **asdict(scenario.library), 'albums': max(1, unindexed // scenario.library.tracks_per_album),
+      'seed': scenario.library.seed + 1,
+    })
+    new_dir = music_dir / 'added after scan'
+    requests += ['added after scan/' + p for p in library.generate_library(new_dir, spec)][:unindexed]
+  rng.shuffle(requests)
+
+  results, wall = await fetch_all(base_url, requests, concurrency)
+  report.update(summarise(results, wall))
+  # the first request for an unindexed file gets a 400 while the rescan runs
+  report['unindexed_requests'] = unindexed
+  report['full_scans'] = file_indexer.full_scans
+  report['coalesced_requests'] = metadata_service.coalesced_requests
+
+  await runner.cleanup()
+  return report
+
+
+def child_main(args):
+  scenario = make_scenarios(args.scale)[args.child]
+  sys.path.insert(0, str(REPO_DIR))
+  import logging
+  logging.disable(logging.WARNING)
+
+  import metadata_service
+  metadata_service.init()
+  report = asyncio.run(run_scenario(scenario, args.concurrency))
+  print(json.dumps(report))
+
+
+def run_child(scenario: Scenario, args) -> dict:
+  with tempfile.TemporaryDirectory(prefix=f'bench-{scenario.name}-') as tmp:
+    work_dir = Path(tmp)
+    (work_dir / 'music').mkdir()
+    env = {
+      **os.environ,
+      'MUSIC_DIR': str(work_dir / 'music'),
+      'COVER_DIR': str(work_dir / 'cover'),
+      'DEFAULT_COVER_PATH': str(REPO_DIR / 'default.png'),
+      'INDEX_SNAPSHOT_PATH': str(work_dir / 'file_index.snapshot'),
+      'WARMER_RATE': '0',
+      **scenario.env,
+      **dict(kv.split('=', 1) for kv in args.env),
+    }
+    cmd = [
+      sys.executable, str(Path(__file__).resolve()), '--child', scenario.name,
+      '--scale', str(args.scale), '--concurrency', str(args.concurrency),
+    ]
+    proc = subprocess.run(cmd, env=env, cwd=work_dir, stdout=subprocess.PIPE, text=True)
+    if proc.returncode != 0:
+      return {'failed': True, 'returncode': proc.returncode}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def git_revision() -> str:
+  try:
+    rev = subprocess.run(
+      ['git', 'describe', '--always', '--dirty'], cwd=REPO_DIR, capture_output=True, text=True, check=True
+    ).stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    rev = 'unknown'
+  return rev
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--scenario', action='append', help='run only these scenarios (default: all)')
+  parser.add_argument('--scale', type=int, default=1, help='multiplier for the library sizes')
+  parser.add_argument('--concurrency', type=int, default=16)
+  parser.add_argument('--env', action='append', default=[], help='KEY=VALUE passed to the server config')
+  parser.add_argument('--output', type=Path, help='write the results as JSON')
+  parser.add_argument('--child', help=argparse.SUPPRESS)
+  args = parser.parse_args()
+
+  if args.child:
+    return child_main(args)
+
+  scenarios = make_scenarios(args.scale)
+  names = args.scenario or list(scenarios)
+  results = {
+    'revision': git_revision(),
+    'timestamp': time.time(),
+    'python': platform.python_version(),
+    'cpus': os.cpu_count(),
+    'scale': args.scale,
+    'concurrency': args.concurrency,
+    'env': args.env,
+    'scenarios': {},
+  }
+
+  print(f'{'scenario':>12} {'files':>6} {'reqs':>6} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'incompl':>7} {'errors':>6} {'scan':>7}')
+  for name in names:
+    report = run_child(scenarios[name], args)
+    results['scenarios'][name] = report
+    if report.get('failed'):
+      print(f'{name:>12} failed with exit code {report['returncode']}')
+      continue
+    print(
+      f'{name:>12} {report['files']:>6} {report['requests']:>6} {report['throughput_rps']:>8.1f}'
+      f' {report['p50_ms']:>6.1f}ms {report['p95_ms']:>6.1f}ms {report['p99_ms']:>6.1f}ms'
+      f' {report['incomplete']:>7} {report['errors']:>6} {report['scan_s']:>6.2f}s'
+    )
+
+  if args.output:
+    args.output.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+  main()
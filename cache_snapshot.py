@@ -0,0 +1,183 @@
+import argparse
+import logging
+import os
+import sqlite3
+import tarfile
+import tempfile
+import time
+from pathlib import Path, PurePosixPath
+
+import cover_store
+import db
+from config import COVER_DIR, MUSIC_DIR
+from metadata_service import cache_matches_stat
+
+
+# a snapshot is an uncompressed tar (the covers are jpegs already) of a backup
+# of the cache db and every cover it references, stored once each under its
+# content addressed name
+SNAPSHOT_DB_NAME = 'cache.db'
+SNAPSHOT_COVER_DIR = PurePosixPath('covers')
+logger = logging.getLogger('snapshot')
+
+
+def export_snapshot(archive_path: Path):
+  start = time.perf_counter()
+  with tempfile.TemporaryDirectory() as tmp:
+    db_copy = os.path.join(tmp, SNAPSHOT_DB_NAME)
+    db.backup_to(db_copy)
+    conn = db.open_copy(db_copy)
+    try:
+      cover_filenames = sorted((
+        {meta.cover_filename for meta in db.iter_audio_metadata(conn)}
+        | {folder_cover.cover.filename for folder_cover in db.iter_folder_covers(conn) if folder_cover.cover}
+      ) - {''})
+    finally:
+      conn.close()
+
+    tmp_path = archive_path.with_name(f'{archive_path.name}.tmp')
+    exported = 0
+    with tarfile.open(tmp_path, 'w') as tar:
+      tar.add(db_copy, arcname=SNAPSHOT_DB_NAME)
+      for filename in cover_filenames:
+        try:
+          tar.add(COVER_DIR / filename, arcname=str(SNAPSHOT_COVER_DIR / filename))
+          exported += 1
+        except FileNotFoundError:
+          logger.warning(f'cover {filename} is missing, its rows will be skipped on import')
+    os.replace(tmp_path, archive_path)
+  logger.info(f'exported the cache db and {exported} covers to {archive_path} in {time.perf_counter() - start:.1f}s')
+
+
+def _stat(relative_path: str) -> os.stat_result | None:
+  try:
+    return (MUSIC_DIR / relative_path).stat()
+  except OSError:
+    return None
+
+
+class _CoverImporter:
+  # copies covers out of the archive the first time they are needed, unless
+  # this node already has them
+  def __init__(self, tar: tarfile.TarFile):
+    self.tar = tar
+    self.members = {
+      member.name: member for member in tar.getmembers()
+      if member.isfile() and PurePosixPath(member.name).parts[0] == SNAPSHOT_COVER_DIR.name
+    }
+    self.available: dict[str, bool] = {}
+    self.copied = 0
+
+  def ensure(self, filename: str) -> bool:
+    if filename not in self.available:
+      self.available[filename] = self._copy(filename)
+    return self.available[filename]
+
+  def _copy(self, filename: str) -> bool:
+    # the name comes from the snapshot's db, anything else could point outside COVER_DIR
+    if not cover_store.is_cover_filename(filename):
+      logger.warning(f'skipping rows with the invalid cover filename {filename!r}')
+      return False
+    out_path = COVER_DIR / filename
+    if out_path.exists():
+      return True
+    member = self.members.get(str(SNAPSHOT_COVER_DIR / filename))
+    if member is None:
+      return False
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = out_path.with_name(f'{out_path.name}.tmp')
+    with self.tar.extractfile(member) as src, open(tmp_path, 'wb') as dst:
+      dst.write(src.read())
+    os.replace(tmp_path, out_path)
+    self.copied += 1
+    return True
+
+
+def import_snapshot(archive_path: Path):
+  # only takes rows that are still current on this node and that this node
+  # doesn't already have a current row for
+  start = time.perf_counter()
+  COVER_DIR.mkdir(parents=True, exist_ok=True)
+  with tempfile.TemporaryDirectory() as tmp, tarfile.open(archive_path) as tar:
+    tar.extract(SNAPSHOT_DB_NAME, tmp, filter='data')
+    conn = db.open_copy(os.path.join(tmp, SNAPSHOT_DB_NAME))
+    try:
+      if (version := db.get_version(conn)) != db.DB_VERSION:
+        raise SystemExit(f'snapshot is from db version {version}, this node uses {db.DB_VERSION}')
+      covers = _CoverImporter(tar)
+      imported = _import_audio_metadata(conn, covers)
+      _import_folder_covers(conn, covers)
+      _import_cover_sources(conn, covers)
+    finally:
+      conn.close()
+  db.flush()
+  logger.info(
+    f'imported {imported} rows and copied {covers.copied} covers from {archive_path}'
+    f' in {time.perf_counter() - start:.1f}s'
+  )
+
+
+def _import_audio_metadata(conn: sqlite3.Connection, covers: _CoverImporter) -> int:
+  imported = skipped = 0
+  for meta in db.iter_audio_metadata(conn):
+    stat = _stat(meta.path)
+    # inodes differ between nodes, the mtime and size say it's the same file.
+    # rows from before file stats were stored can't be checked on another node
+    if not stat or not meta.file_mtime_ns or (meta.file_mtime_ns, meta.file_size) != (stat.st_mtime_ns, stat.st_size):
+      skipped += 1
+      continue
+    local = db.get_audio_metadata_by_path(PurePosixPath(meta.path))
+    if local and local.file_mtime_ns and cache_matches_stat(local, stat):
+      continue
+    if not meta.cover_filename or not covers.ensure(meta.cover_filename):
+      skipped += 1
+      continue
+    meta.file_inode = stat.st_ino
+    db.store_audio_metadata(meta)
+    imported += 1
+  if skipped:
+    logger.info(f'skipped {skipped} rows whose file changed, is missing or has no cover')
+  return imported
+
+
+def _import_folder_covers(conn: sqlite3.Connection, covers: _CoverImporter):
+  for folder_cover in db.iter_folder_covers(conn):
+    local_dir = MUSIC_DIR / folder_cover.dir
+    try:
+      if local_dir.stat().st_mtime_ns != folder_cover.dir_mtime_ns:
+        continue
+      if folder_cover.image_name:
+        image_stat = (local_dir / folder_cover.image_name).stat()
+        if (image_stat.st_mtime_ns, image_stat.st_size) != (folder_cover.image_mtime_ns, folder_cover.image_size):
+          continue
+    except OSError:
+      continue
+    if folder_cover.cover and not covers.ensure(folder_cover.cover.filename):
+      continue
+    local = db.get_folder_cover(folder_cover.dir)
+    if not local or local.dir_mtime_ns != folder_cover.dir_mtime_ns:
+      db.store_folder_cover(folder_cover)
+
+
+def _import_cover_sources(conn: sqlite3.Connection, covers: _CoverImporter):
+  # lets jobs on this node skip decoding source images it has seen elsewhere
+  for source_hash, cover in db.iter_cover_sources(conn):
+    if not db.get_cover_by_source_hash(source_hash) and covers.ensure(cover.filename):
+      db.store_cover_source(source_hash, cover)
+
+
+if __name__ == '__main__':
+  logging.basicConfig(level=logging.INFO)
+  parser = argparse.ArgumentParser(description='Copy the metadata cache and covers between nodes.')
+  subparsers = parser.add_subparsers(dest='command', required=True)
+  subparsers.add_parser('export', help='write a snapshot of the cache db and its covers').add_argument(
+    'archive', type=Path
+  )
+  subparsers.add_parser('import', help='add the still current rows of a snapshot to the local cache').add_argument(
+    'archive', type=Path
+  )
+  args = parser.parse_args()
+  if args.command == 'export':
+    export_snapshot(args.archive)
+  else:
+    import_snapshot(args.archive)
@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import os
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from pathlib import PurePosixPath
+
+import db
+import file_indexer
+import metadata_service
+import metrics
+from config import METADATA_WORKERS, MUSIC_DIR, REVALIDATE_INTERVAL, WARMER_RATE
+
+
+PROGRESS_LOG_INTERVAL = 30
+logger = logging.getLogger('warmer')
+
+
+@dataclass(kw_only=True)
+class WarmerProgress:
+  done: int = 0
+  failed: int = 0
+  remaining: int = 0
+  started_at: float = field(default_factory=time.monotonic)
+  finished_at: float | None = None
+
+  @property
+  def rate(self) -> float:
+    elapsed = (self.finished_at or time.monotonic()) - self.started_at
+    return self.done / elapsed if elapsed > 0 else 0
+
+  def __str__(self):
+    return f'{self.done} done, {self.failed} failed, {self.remaining} remaining ({self.rate:.2f} files/s)'
+
+
+def _pool_is_busy():
+  # always leave a worker free so live requests never queue behind warming
+  return len(metadata_service.in_flight_jobs) >= max(1, METADATA_WORKERS - 1)
+
+
+async def _warm_file(path: str):
+  while _pool_is_busy():
+    await asyncio.sleep(0.1)
+  await metadata_service.get_audio_metadata(PurePosixPath(path), uuid='warmer', timeout=None)
+
+
+async def run():
+  global progress
+  cached_paths = await asyncio.to_thread(db.get_cached_paths)
+  pending = sorted(path for path in file_indexer.discovered_files if path not in cached_paths)
+  progress = WarmerProgress(remaining=len(pending))
+  logger.info(f'warming metadata cache for {len(pending)} files at {WARMER_RATE} files/s')
+
+  last_log = time.monotonic()
+  for path in pending:
+    start = time.monotonic()
+    progress.remaining -= 1
+    if not file_indexer.path_is_valid(path):
+      continue
+    try:
+      await _warm_file(path)
+      progress.done += 1
+    except Exception as e:
+      progress.failed += 1
+      logger.warning(f'failed to warm {path}: {e!r}')
+
+    if start - last_log >= PROGRESS_LOG_INTERVAL:
+      logger.info(f'progress: {progress}')
+      last_log = start
+    await asyncio.sleep(max(0, 1 / WARMER_RATE - (time.monotonic() - start)))
+
+  progress.finished_at = time.monotonic()
+  logger.info(f'finished: {progress}')
+
+
+def _find_stale_paths() -> tuple[list[str], list[str]]:
+  # returns the cached paths whose file changed and the ones whose file is gone,
+  # listing each directory once instead of a stat per path. blocking
+  rows_by_dir: defaultdict[str, list[db.FileStat]] = defaultdict(list)
+  for row in db.get_file_stats():
+    rows_by_dir[str(PurePosixPath(row.path).parent)].append(row)
+
+  stale: list[str] = []
+  missing: list[str] = []
+  for relative_dir, rows in rows_by_dir.items():
+    try:
+      with os.scandir(MUSIC_DIR / relative_dir) as entries:
+        entries_by_name = {entry.name: entry for entry in entries}
+    except OSError:
+      # the whole directory may only be missing for now (e.g. an unmounted drive)
+      continue
+    for row in rows:
+      entry = entries_by_name.get(PurePosixPath(row.path).name)
+      try:
+        if entry is None:
+          raise FileNotFoundError
+        if not metadata_service.cache_matches_stat(row, entry.stat()):
+          stale.append(row.path)
+      except FileNotFoundError:
+        missing.append(row.path)
+  return stale, missing
+
+
+async def revalidate():
+  start = time.monotonic()
+  stale, missing = await asyncio.to_thread(_find_stale_paths)
+  if missing:
+    await asyncio.to_thread(db.delete_audio_metadata, missing)
+  metrics.revalidated_rows.inc('stale', len(stale))
+  metrics.revalidated_rows.inc('missing', len(missing))
+  logger.info(
+    f'revalidation found {len(stale)} changed and {len(missing)} deleted files'
+    f' in {time.monotonic() - start:.1f}s'
+  )
+
+  for path in stale:
+    if not file_indexer.path_is_valid(PurePosixPath(path)):
+      continue
+    try:
+      await _warm_file(path)
+    except Exception as e:
+      logger.warning(f'failed to re-read {path}: {e!r}')
+
+
+async def _revalidate_loop():
+  while True:
+    try:
+      await revalidate()
+    except Exception:
+      logger.exception('revalidation failed')
+    await asyncio.sleep(REVALIDATE_INTERVAL)
+
+
+def start_revalidation():
+  global revalidate_task
+  if REVALIDATE_INTERVAL <= 0 or (revalidate_task and not revalidate_task.done()):
+    return
+  revalidate_task = asyncio.create_task(_revalidate_loop())
+
+
+def start():
+  global warmer_task
+  if WARMER_RATE <= 0 or (warmer_task and not warmer_task.done()):
+    return
+  warmer_task = asyncio.create_task(run())
+
+
+progress: WarmerProgress | None = None
+warmer_task: asyncio.Task | None = None
+revalidate_task: asyncio.Task | None = None
+
+metrics.Gauge('warmer_done_files', 'Files the cache warmer has read.', lambda: progress.done if progress else 0)
+metrics.Gauge('warmer_failed_files', 'Files the cache warmer failed to read.', lambda: progress.failed if progress else 0)
+metrics.Gauge(
+  'warmer_remaining_files', 'Files the cache warmer has yet to read.', lambda: progress.remaining if progress else 0
+)
+metrics.Gauge('warmer_files_per_second', 'Files read per second by the cache warmer.', lambda: progress.rate if progress else 0)
@@ -6,8 +6,21 @@ PORT = int(os.environ.get('PORT', 36900))
 # set to 1 to serve files (for testing)
 SERVE_FILES = os.environ.get('SERVE_FILES', '0') == '1'
 
+# number of processes serving http requests on PORT, when more than 1 the main
+# process only keeps the file index and metadata pool and serves them to the
+# http workers through a unix socket at HUB_SOCKET_PATH
+HTTP_WORKERS = int(os.environ.get('HTTP_WORKERS', 1))
+HUB_SOCKET_PATH = Path(os.environ.get('HUB_SOCKET_PATH', 'hub.sock')).resolve()
+
 # size of process pool used for reading file metadata
 METADATA_WORKERS = int(os.environ.get('METADATA_WORKERS', 4))
+# most metadata jobs that may wait for a free pool worker, requests beyond that
+# (or whose job wouldn't finish before their timeout) get a placeholder straight away
+METADATA_QUEUE_LIMIT = int(os.environ.get('METADATA_QUEUE_LIMIT', METADATA_WORKERS * 8))
+# seconds cache db writes are held back for so they can be written in batches,
+# a batch is written early once it reaches DB_WRITE_BATCH_SIZE rows
+DB_WRITE_DELAY = float(os.environ.get('DB_WRITE_DELAY', 0.5))
+DB_WRITE_BATCH_SIZE = int(os.environ.get('DB_WRITE_BATCH_SIZE', 200))
 
 # host to use when generating absolute urls to files, if set to an empty string
 # the X-Forwarded-Host header or Host header is used
@@ -28,4 +41,69 @@ COVER_DIR = Path(os.environ.get('COVER_DIR', 'cover/')).resolve()
 # http path of the cover directory
 COVER_HTTP_ROOT = PurePosixPath(os.environ.get('COVER_HTTP_ROOT', '/cover/'))
 
-DEFAULT_COVER_PATH = Path(os.environ.get('DEFAULT_COVER_PATH', 'default.png')).resolve()
\ No newline at end of file
+# seconds between removing stored covers that no audio file uses, 0 disables it.
+# covers younger than COVER_GC_MIN_AGE seconds are always kept. also available
+# as a command: python cover_store.py [--dry-run]
+COVER_GC_INTERVAL = float(os.environ.get('COVER_GC_INTERVAL', 24 * 60 * 60))
+COVER_GC_MIN_AGE = float(os.environ.get('COVER_GC_MIN_AGE', 24 * 60 * 60))
+
+# how source images are scaled down to covers: 'quality' decodes them at full
+# size and resamples with LANCZOS, 'fast' lets JPEGs decode at a reduced scale
+# (1/2 to 1/8) and resamples with COVER_FAST_RESAMPLE. the cover dimensions are
+# the same either way, and so are the file names (the hash of the source image),
+# so switching modes keeps using the covers already stored
+COVER_RESIZE_MODE = os.environ.get('COVER_RESIZE_MODE', 'quality')
+# PIL resampling filter used by the fast mode, e.g. 'bicubic', 'bilinear' or 'lanczos'
+COVER_FAST_RESAMPLE = os.environ.get('COVER_FAST_RESAMPLE', 'bicubic')
+
+DEFAULT_COVER_PATH = Path(os.environ.get('DEFAULT_COVER_PATH', 'default.png')).resolve()
+# set to 0 to skip checking that a cached cover still exists before using it
+VERIFY_CACHED_COVERS = os.environ.get('VERIFY_CACHED_COVERS', '1') == '1'
+
+# http path the prometheus metrics are served on, set to an empty string to disable
+METRICS_PATH = os.environ.get('METRICS_PATH', '/metrics')
+
+# http path of the batch metadata endpoint, set to an empty string to disable
+BATCH_API_PATH = os.environ.get('BATCH_API_PATH', '/api/batch')
+# most paths accepted in one batch request
+BATCH_MAX_PATHS = int(os.environ.get('BATCH_MAX_PATHS', 1000))
+# longest a batch request waits (in seconds) for metadata that isn't cached
+BATCH_TIMEOUT = float(os.environ.get('BATCH_TIMEOUT', 30))
+
+# http path of the tag search endpoint, set to an empty string to disable
+SEARCH_API_PATH = os.environ.get('SEARCH_API_PATH', '/api/search')
+# most matches returned by one search
+SEARCH_MAX_RESULTS = int(os.environ.get('SEARCH_MAX_RESULTS', 50))
+
+# number of complete metadata entries to keep in memory, requests for them
+# are answered without a pool job. 0 disables the cache
+METADATA_CACHE_SIZE = int(os.environ.get('METADATA_CACHE_SIZE', 10000))
+
+# number of rendered embed pages to keep in memory, 0 disables the cache
+EMBED_CACHE_SIZE = int(os.environ.get('EMBED_CACHE_SIZE', 1024))
+
+# files per second to pre-warm the metadata cache with after scanning the
+# music directory, 0 disables warming
+WARMER_RATE = float(os.environ.get('WARMER_RATE', 0))
+
+# seconds between sweeps that stat every file in the metadata cache and re-read
+# the ones that changed (rows of deleted files are removed), 0 disables them.
+# the first sweep runs after the music directory is scanned
+REVALIDATE_INTERVAL = float(os.environ.get('REVALIDATE_INTERVAL', 24 * 60 * 60))
+
+# how to keep the file index up to date after the initial scan: 'inotify',
+# 'poll' (re-list directories whose mtime changed), 'auto' (inotify, falling
+# back to polling) or 'off' (full rescans when an unknown file is requested)
+INDEX_WATCH = os.environ.get('INDEX_WATCH', 'auto')
+# seconds between directory mtime checks when polling
+INDEX_POLL_INTERVAL = float(os.environ.get('INDEX_POLL_INTERVAL', 60))
+# requested paths that turned out not to be files are remembered for
+# MISSING_PATH_TTL seconds (up to MISSING_PATH_CACHE_SIZE of them, or until the
+# index changes) so repeated requests don't touch the disk
+MISSING_PATH_CACHE_SIZE = int(os.environ.get('MISSING_PATH_CACHE_SIZE', 10000))
+MISSING_PATH_TTL = float(os.environ.get('MISSING_PATH_TTL', 60))
+# least seconds between full rescans triggered by requests for new files (only
+# when INDEX_WATCH is off), later requests wait for the next one
+RESCAN_MIN_INTERVAL = float(os.environ.get('RESCAN_MIN_INTERVAL', 60))
+# file the index is saved to, so it can be loaded instantly on startup
+INDEX_SNAPSHOT_PATH = Path(os.environ.get('INDEX_SNAPSHOT_PATH', 'file_index.snapshot')).resolve()
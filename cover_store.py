@@ -0,0 +1,126 @@
+import argparse
+import asyncio
+import logging
+import os
+import re
+import time
+from pathlib import Path, PurePosixPath
+
+import db
+import metrics
+from config import COVER_DIR, COVER_GC_INTERVAL, COVER_GC_MIN_AGE
+
+
+# covers are stored as <ab>/<cd>/<abcd...>.jpg so no directory gets too big
+FLAT_COVER_NAME = re.compile(r'^[0-9a-f]{64}\.jpg$')
+COVER_HASH = re.compile(r'[0-9a-f]{64}')
+logger = logging.getLogger('covers')
+
+
+def get_cover_filename(im_hash: str) -> str:
+  return f'{im_hash[:2]}/{im_hash[2:4]}/{im_hash}.jpg'
+
+
+def is_cover_filename(filename: str) -> bool:
+  # whether a name from elsewhere (e.g. a snapshot) is one get_cover_filename
+  # makes, and so safe to join onto COVER_DIR
+  im_hash = PurePosixPath(filename).stem
+  return bool(COVER_HASH.fullmatch(im_hash)) and filename == get_cover_filename(im_hash)
+
+
+def get_sharded_filename(flat_filename: str) -> str | None:
+  # where a cover from the old flat layout lives now, None for other names
+  if not FLAT_COVER_NAME.match(flat_filename):
+    return None
+  return get_cover_filename(flat_filename.removesuffix('.jpg'))
+
+
+def migrate_flat_covers():
+  # moves covers left in the top level of COVER_DIR into their shard, the db
+  # rows are rewritten by the db migration to version 3
+  moved = 0
+  with os.scandir(COVER_DIR) as entries:
+    for entry in entries:
+      if not entry.is_file() or not (filename := get_sharded_filename(entry.name)):
+        continue
+      out_path = COVER_DIR / filename
+      out_path.parent.mkdir(parents=True, exist_ok=True)
+      os.replace(entry.path, out_path)
+      moved += 1
+  if moved:
+    logger.info(f'moved {moved} covers to the sharded layout')
+
+
+def _iter_stored_covers():
+  # (filename relative to COVER_DIR, mtime) of every stored cover
+  for shard in os.scandir(COVER_DIR):
+    if not shard.is_dir():
+      continue
+    for subshard in os.scandir(shard.path):
+      if not subshard.is_dir():
+        continue
+      for entry in os.scandir(subshard.path):
+        if entry.is_file():
+          yield f'{shard.name}/{subshard.name}/{entry.name}', entry.stat().st_mtime
+
+
+def collect_garbage(keep: set[str], min_age: float = COVER_GC_MIN_AGE, dry_run=False) -> list[str]:
+  # removes covers that no audio file uses. covers newer than min_age are kept,
+  # the rows referencing them may still be waiting to be written by a worker.
+  # blocking, run it in a thread
+  start = time.perf_counter()
+  referenced = db.get_referenced_cover_filenames() | keep
+  cutoff = time.time() - min_age
+  removed = []
+  for filename, mtime in _iter_stored_covers():
+    if filename in referenced or mtime > cutoff:
+      continue
+    if not dry_run:
+      (COVER_DIR / filename).unlink(missing_ok=True)
+    removed.append(filename)
+  if removed and not dry_run:
+    # so the source and folder lookups don't hand out the removed files
+    db.delete_cover_references(removed)
+    metrics.covers_removed.inc(amount=len(removed))
+  logger.info(
+    f'{'would remove' if dry_run else 'removed'} {len(removed)} unreferenced covers'
+    f' in {time.perf_counter() - start:.1f}s'
+  )
+  return removed
+
+
+async def _gc_loop(keep: set[str]):
+  while True:
+    await asyncio.sleep(COVER_GC_INTERVAL)
+    try:
+      await asyncio.to_thread(collect_garbage, keep)
+    except Exception:
+      logger.exception('cover garbage collection failed')
+
+
+def start(keep: set[str]):
+  global gc_task
+  if COVER_GC_INTERVAL <= 0 or (gc_task and not gc_task.done()):
+    return
+  gc_task = asyncio.create_task(_gc_loop(keep))
+
+
+gc_task: asyncio.Task | None = None
+
+
+if __name__ == '__main__':
+  logging.basicConfig(level=logging.INFO)
+  parser = argparse.ArgumentParser(description='Remove stored covers that no audio file uses.')
+  parser.add_argument('--min-age', type=float, default=COVER_GC_MIN_AGE, help='seconds, newer covers are kept')
+  parser.add_argument('--dry-run', action='store_true', help='only list the covers that would be removed')
+  args = parser.parse_args()
+
+  import metadata_service
+  from config import DEFAULT_COVER_PATH
+
+  COVER_DIR.mkdir(exist_ok=True, parents=True)
+  migrate_flat_covers()
+  default_cover = metadata_service.store_image_file(DEFAULT_COVER_PATH)
+  for filename in collect_garbage({default_cover.filename}, min_age=args.min_age, dry_run=args.dry_run):
+    if args.dry_run:
+      print(filename)
@@ -1,44 +1,218 @@
 from argparse import _VersionAction
 import multiprocessing
+import multiprocessing.util
+import os
 from pathlib import PurePosixPath
+import re
 import sqlite3
 import logging
+import threading
+import time
+from collections import defaultdict
 from dataclasses import dataclass
+from collections.abc import Iterator
+from typing import Any
 
+import metrics
+from config import DB_WRITE_BATCH_SIZE, DB_WRITE_DELAY
 from metadata_tags import Tags
 
 
 logger = logging.getLogger('db')
-DB_VERSION = 1
-db = sqlite3.connect('cache.db')
-db.row_factory = sqlite3.Row
+DB_VERSION = 5
+DB_PATH = 'cache.db'
+
+# connections can't be shared across processes (or threads), each gets its own
+_local = threading.local()
+
+
+def get_connection() -> sqlite3.Connection:
+  if getattr(_local, 'pid', None) != os.getpid():
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    conn.row_factory = sqlite3.Row
+    # WAL is persistent and set once at init, this is per connection
+    _ = conn.execute('PRAGMA synchronous = NORMAL')
+    _local.conn, _local.pid = conn, os.getpid()
+  return _local.conn
+
+
+@dataclass(kw_only=True)
+class PendingWrite:
+  sql: str
+  params: dict[str, Any] | tuple
+  # the object being stored, returned by reads until the write is flushed
+  value: Any
+
+
+# writes are queued here and flushed in batches by a background thread, keyed
+# by (table, primary key) so a newer write replaces an unflushed older one
+_pending_writes: dict[tuple[str, str], PendingWrite] = {}
+_pending_lock = threading.Lock()
+_flush_wakeup = threading.Event()
+_flusher_pid: int | None = None
+
+
+def _reset_after_fork():
+  # pool workers are forked from a process whose flush thread may hold the
+  # lock, and whose queued writes are its own to flush
+  global _pending_writes, _pending_lock, _flush_wakeup
+  _pending_writes = {}
+  _pending_lock = threading.Lock()
+  _flush_wakeup = threading.Event()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _get_pending(table: str, key: str):
+  if write := _pending_writes.get((table, key)):
+    return write.value
+
+
+def _queue_write(table: str, key: str, write: PendingWrite):
+  global _flusher_pid
+  with _pending_lock:
+    _pending_writes[(table, key)] = write
+    if _flusher_pid != os.getpid():
+      _flusher_pid = os.getpid()
+      threading.Thread(target=_flush_loop, name='db-flush', daemon=True).start()
+      # pool workers exit through multiprocessing, which skips atexit
+      multiprocessing.util.Finalize(None, flush, exitpriority=100)
+    if len(_pending_writes) >= DB_WRITE_BATCH_SIZE:
+      _flush_wakeup.set()
+
+
+def flush():
+  with _pending_lock:
+    writes = dict(_pending_writes)
+  if not writes:
+    return
+  batches: defaultdict[tuple[str, str], list] = defaultdict(list)
+  for (table, _), write in writes.items():
+    batches[(table, write.sql)].append(write.params)
+  start = time.perf_counter()
+  conn = get_connection()
+  # a transaction per statement, so a failing one doesn't take the others with it
+  for (table, sql), params in batches.items():
+    try:
+      with conn as cur:
+        _ = cur.executemany(sql, params)
+    except:
+      logger.exception(f'Error writing {len(params)} rows to {table}, dropping them')
+  metrics.record_db_flush(time.perf_counter() - start)
+  with _pending_lock:
+    for key, write in writes.items():
+      if _pending_writes.get(key) is write:
+        del _pending_writes[key]
+
+
+def _flush_loop():
+  while True:
+    _flush_wakeup.wait(DB_WRITE_DELAY)
+    _flush_wakeup.clear()
+    flush()
 
 
 @dataclass(kw_only=True)
 class CachedAudioMetadata:
   path: str
+  # when the row was written
   mtime: int | None = None
+  # of the audio file when it was read, rows from before version 5 have 0
+  file_mtime_ns: int = 0
+  file_size: int = 0
+  file_inode: int = 0
   cover_filename: str = ''
+  cover_width: int = 0
+  cover_height: int = 0
+  # size of the stored cover file in bytes
+  cover_size: int = 0
   tags: Tags
 
 
+@dataclass(kw_only=True)
+class Cover:
+  filename: str
+  width: int
+  height: int
+  size: int = 0
+
+
+@dataclass(kw_only=True)
+class FolderCover:
+  # relative path of the directory and the image chosen as its cover
+  dir: str
+  dir_mtime_ns: int
+  image_name: str = ''
+  image_mtime_ns: int = 0
+  image_size: int = 0
+  cover: Cover | None = None
+
+
+@dataclass(kw_only=True, slots=True)
+class FileStat:
+  # the columns of an audio_files row that say which version of the file it's for
+  path: str
+  mtime: int
+  file_mtime_ns: int
+  file_size: int
+  file_inode: int
+
+
+AUDIO_FILE_COLUMNS = '''
+  path, mtime, file_mtime_ns, file_size, file_inode,
+  cover_filename, cover_width, cover_height, cover_size,
+  artist, title, album, date
+'''
+# sqlite's default limit on the number of ? in a statement is 32766 (999 before 3.32)
+MAX_QUERY_PARAMS = 500
+
+
 def get_audio_metadata_by_path(relative_path: PurePosixPath):
-  with db as cur:
+  if pending := _get_pending('audio_files', str(relative_path)):
+    return pending
+  with get_connection() as cur:
     row: sqlite3.Row = cur.execute(
-      '''
-        SELECT
-          path, mtime, cover_filename, artist, title, album, date
-        FROM audio_files
-        WHERE path = ?
-      ''',
+      f'SELECT {AUDIO_FILE_COLUMNS} FROM audio_files WHERE path = ?',
       (str(relative_path),)
     ).fetchone()
   if not row:
     return
+  return _audio_metadata_from_row(row)
+
+
+def get_audio_metadata_by_paths(relative_paths: list[str]) -> dict[str, CachedAudioMetadata]:
+  # looks up many paths with one query per MAX_QUERY_PARAMS paths
+  found: dict[str, CachedAudioMetadata] = {}
+  missing: list[str] = []
+  for path in relative_paths:
+    if pending := _get_pending('audio_files', path):
+      found[path] = pending
+    else:
+      missing.append(path)
+  with get_connection() as cur:
+    for i in range(0, len(missing), MAX_QUERY_PARAMS):
+      chunk = missing[i:i + MAX_QUERY_PARAMS]
+      rows = cur.execute(
+        f'SELECT {AUDIO_FILE_COLUMNS} FROM audio_files WHERE path IN ({', '.join('?' * len(chunk))})',
+        chunk
+      )
+      for row in rows:
+        found[row['path']] = _audio_metadata_from_row(row)
+  return found
+
+
+def _audio_metadata_from_row(row: sqlite3.Row):
   return CachedAudioMetadata(
     path=row['path'],
     mtime=row['mtime'],
+    file_mtime_ns=row['file_mtime_ns'],
+    file_size=row['file_size'],
+    file_inode=row['file_inode'],
     cover_filename=row['cover_filename'],
+    cover_width=row['cover_width'],
+    cover_height=row['cover_height'],
+    cover_size=row['cover_size'],
     tags=Tags(
       artist=row['artist'],
       title=row['title'],
@@ -48,32 +222,361 @@ def get_audio_metadata_by_path(relative_path: PurePosixPath):
   )
 
 
+def get_cover_by_source_hash(source_hash: str) -> Cover | None:
+  if pending := _get_pending('cover_sources', source_hash):
+    return pending
+  with get_connection() as cur:
+    row: sqlite3.Row = cur.execute(
+      'SELECT cover_filename, width, height, size FROM cover_sources WHERE source_hash = ?',
+      (source_hash,)
+    ).fetchone()
+  if not row:
+    return
+  return Cover(filename=row['cover_filename'], width=row['width'], height=row['height'], size=row['size'])
+
+
+def store_cover_source(source_hash: str, cover: Cover):
+  _queue_write('cover_sources', source_hash, PendingWrite(
+    sql=(
+      'INSERT OR REPLACE INTO cover_sources'
+      '(source_hash, cover_filename, width, height, size)'
+      'VALUES'
+      '(?, ?, ?, ?, ?)'
+    ),
+    params=(source_hash, cover.filename, cover.width, cover.height, cover.size),
+    value=cover,
+  ))
+
+
+FOLDER_COVER_COLUMNS = '''
+  dir, dir_mtime_ns, image_name, image_mtime_ns, image_size,
+  cover_filename, cover_width, cover_height, cover_size
+'''
+
+
+def get_folder_cover(relative_dir: str) -> FolderCover | None:
+  if pending := _get_pending('folder_covers', relative_dir):
+    return pending
+  with get_connection() as cur:
+    row: sqlite3.Row = cur.execute(
+      f'SELECT {FOLDER_COVER_COLUMNS} FROM folder_covers WHERE dir = ?',
+      (relative_dir,)
+    ).fetchone()
+  if not row:
+    return
+  return _folder_cover_from_row(row)
+
+
+def get_folder_covers(relative_dirs: list[str]) -> dict[str, FolderCover]:
+  found: dict[str, FolderCover] = {}
+  missing: list[str] = []
+  for relative_dir in relative_dirs:
+    if pending := _get_pending('folder_covers', relative_dir):
+      found[relative_dir] = pending
+    else:
+      missing.append(relative_dir)
+  with get_connection() as cur:
+    for i in range(0, len(missing), MAX_QUERY_PARAMS):
+      chunk = missing[i:i + MAX_QUERY_PARAMS]
+      rows = cur.execute(
+        f'SELECT {FOLDER_COVER_COLUMNS} FROM folder_covers WHERE dir IN ({', '.join('?' * len(chunk))})',
+        chunk
+      )
+      for row in rows:
+        found[row['dir']] = _folder_cover_from_row(row)
+  return found
+
+
+def _folder_cover_from_row(row: sqlite3.Row):
+  return FolderCover(
+    dir=row['dir'],
+    dir_mtime_ns=row['dir_mtime_ns'],
+    image_name=row['image_name'],
+    image_mtime_ns=row['image_mtime_ns'],
+    image_size=row['image_size'],
+    cover=Cover(
+      filename=row['cover_filename'],
+      width=row['cover_width'],
+      height=row['cover_height'],
+      size=row['cover_size'],
+    ) if row['image_name'] else None
+  )
+
+
+def store_folder_cover(folder_cover: FolderCover):
+  cover = folder_cover.cover or Cover(filename='', width=0, height=0)
+  _queue_write('folder_covers', folder_cover.dir, PendingWrite(
+    sql=(
+      'INSERT OR REPLACE INTO folder_covers'
+      '(dir, dir_mtime_ns, image_name, image_mtime_ns, image_size,'
+      ' cover_filename, cover_width, cover_height, cover_size)'
+      'VALUES'
+      '(?, ?, ?, ?, ?, ?, ?, ?, ?)'
+    ),
+    params=(
+      folder_cover.dir, folder_cover.dir_mtime_ns, folder_cover.image_name,
+      folder_cover.image_mtime_ns, folder_cover.image_size,
+      cover.filename, cover.width, cover.height, cover.size,
+    ),
+    value=folder_cover,
+  ))
+
+
+def get_cached_paths() -> set[str]:
+  with get_connection() as cur:
+    paths = {row['path'] for row in cur.execute('SELECT path FROM audio_files')}
+  return paths | {key for table, key in list(_pending_writes) if table == 'audio_files'}
+
+
 def store_audio_metadata(meta: CachedAudioMetadata):
-  with db as cur:
-    _ = cur.execute(
-      (
-        'INSERT OR REPLACE INTO audio_files'
-        '(path, cover_filename, artist, title, album, date)'
-        'VALUES'
-        '(:path, :cover_filename, :artist, :title, :album, :date)'
-      ),
-      {
-        'path': meta.path,
-        'cover_filename': meta.cover_filename,
-        'artist': meta.tags.artist,
-        'title': meta.tags.title,
-        'album': meta.tags.album,
-        'date': meta.tags.date,
-      }
+  # mtime is the time the row was written, set here as the write may be delayed
+  meta.mtime = int(time.time())
+  _queue_write('audio_files', meta.path, PendingWrite(
+    sql=(
+      # an upsert rather than INSERT OR REPLACE, so the row keeps its rowid
+      # and the search index triggers see an update
+      'INSERT INTO audio_files'
+      '(path, mtime, file_mtime_ns, file_size, file_inode,'
+      ' cover_filename, cover_width, cover_height, cover_size, artist, title, album, date)'
+      'VALUES'
+      '(:path, :mtime, :file_mtime_ns, :file_size, :file_inode,'
+      ' :cover_filename, :cover_width, :cover_height, :cover_size, :artist, :title, :album, :date)'
+      'ON CONFLICT(path) DO UPDATE SET'
+      ' mtime = excluded.mtime, file_mtime_ns = excluded.file_mtime_ns,'
+      ' file_size = excluded.file_size, file_inode = excluded.file_inode,'
+      ' cover_filename = excluded.cover_filename,'
+      ' cover_width = excluded.cover_width, cover_height = excluded.cover_height,'
+      ' cover_size = excluded.cover_size, artist = excluded.artist, title = excluded.title,'
+      ' album = excluded.album, date = excluded.date'
+    ),
+    params={
+      'path': meta.path,
+      'mtime': meta.mtime,
+      'file_mtime_ns': meta.file_mtime_ns,
+      'file_size': meta.file_size,
+      'file_inode': meta.file_inode,
+      'cover_filename': meta.cover_filename,
+      'cover_width': meta.cover_width,
+      'cover_height': meta.cover_height,
+      'cover_size': meta.cover_size,
+      'artist': meta.tags.artist,
+      'title': meta.tags.title,
+      'album': meta.tags.album,
+      'date': meta.tags.date,
+    },
+    value=meta,
+  ))
+
+
+def _search_query(query: str) -> str:
+  # every word has to match the start of a word in the artist, title or album
+  words = re.findall(r'\w+', query)
+  return ' '.join(f'"{word}"*' for word in words)
+
+
+def search_audio_metadata(query: str, limit: int) -> list[CachedAudioMetadata]:
+  # best matches first, titles weigh more than artists and artists more than albums
+  match = _search_query(query)
+  if not match:
+    return []
+  with get_connection() as cur:
+    rows = cur.execute(
+      'SELECT a.* FROM audio_files_fts f JOIN audio_files a ON a.rowid = f.rowid'
+      ' WHERE audio_files_fts MATCH ?'
+      ' ORDER BY bm25(audio_files_fts, 2.0, 3.0, 1.0)'
+      ' LIMIT ?',
+      (match, limit)
+    ).fetchall()
+  return [_audio_metadata_from_row(row) for row in rows]
+
+
+def get_file_stats() -> list[FileStat]:
+  with get_connection() as cur:
+    rows = cur.execute('SELECT path, mtime, file_mtime_ns, file_size, file_inode FROM audio_files')
+    return [FileStat(**row) for row in rows]
+
+
+def delete_audio_metadata(relative_paths: list[str]):
+  with _pending_lock:
+    for path in relative_paths:
+      _pending_writes.pop(('audio_files', path), None)
+  with get_connection() as cur:
+    for i in range(0, len(relative_paths), MAX_QUERY_PARAMS):
+      chunk = relative_paths[i:i + MAX_QUERY_PARAMS]
+      _ = cur.execute(f'DELETE FROM audio_files WHERE path IN ({', '.join('?' * len(chunk))})', chunk)
+
+
+def get_referenced_cover_filenames() -> set[str]:
+  with get_connection() as cur:
+    filenames = {row['cover_filename'] for row in cur.execute('SELECT DISTINCT cover_filename FROM audio_files')}
+  with _pending_lock:
+    pending = [w.value for (table, _), w in _pending_writes.items() if table == 'audio_files']
+  return (filenames | {meta.cover_filename for meta in pending}) - {''}
+
+
+def delete_cover_references(cover_filenames: list[str]):
+  # drops the lookup rows pointing at removed covers, they are recreated when needed
+  with get_connection() as cur:
+    for i in range(0, len(cover_filenames), MAX_QUERY_PARAMS):
+      chunk = cover_filenames[i:i + MAX_QUERY_PARAMS]
+      placeholders = ', '.join('?' * len(chunk))
+      _ = cur.execute(f'DELETE FROM cover_sources WHERE cover_filename IN ({placeholders})', chunk)
+      _ = cur.execute(f'DELETE FROM folder_covers WHERE cover_filename IN ({placeholders})', chunk)
+
+
+def backup_to(path: str):
+  # consistent copy of the whole db, written while readers and writers carry on
+  dest = sqlite3.connect(path)
+  try:
+    get_connection().backup(dest)
+  finally:
+    dest.close()
+
+
+def open_copy(path: str) -> sqlite3.Connection:
+  # a db made by backup_to (possibly on another node), read with the functions below
+  conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+  conn.row_factory = sqlite3.Row
+  return conn
+
+
+def get_version(conn: sqlite3.Connection) -> int:
+  return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def iter_audio_metadata(conn: sqlite3.Connection) -> Iterator[CachedAudioMetadata]:
+  for row in conn.execute(f'SELECT {AUDIO_FILE_COLUMNS} FROM audio_files'):
+    yield _audio_metadata_from_row(row)
+
+
+def iter_folder_covers(conn: sqlite3.Connection) -> Iterator[FolderCover]:
+  for row in conn.execute(f'SELECT {FOLDER_COVER_COLUMNS} FROM folder_covers'):
+    yield _folder_cover_from_row(row)
+
+
+def iter_cover_sources(conn: sqlite3.Connection) -> Iterator[tuple[str, Cover]]:
+  for row in conn.execute('SELECT source_hash, cover_filename, width, height, size FROM cover_sources'):
+    yield row['source_hash'], Cover(filename=row['cover_filename'], width=row['width'], height=row['height'], size=row['size'])
+
+
+def _shard_cover_filenames(table: str) -> str:
+  # <hash>.jpg -> <ab>/<cd>/<hash>.jpg, see cover_store.get_cover_filename
+  return (
+    f"UPDATE {table} SET cover_filename ="
+    f" substr(cover_filename, 1, 2) || '/' || substr(cover_filename, 3, 2) || '/' || cover_filename"
+    f" WHERE cover_filename != '' AND instr(cover_filename, '/') = 0"
+  )
+
+
+# hash of the encoded source image (embedded picture or image file) -> stored cover
+COVER_SOURCES_SCHEMA = '''
+  CREATE TABLE IF NOT EXISTS cover_sources (
+    source_hash TEXT PRIMARY KEY NOT NULL,
+    cover_filename TEXT NOT NULL,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    size INTEGER NOT NULL
+  )
+'''
+# cover image chosen for each directory, image_name is empty if it has none
+FOLDER_COVERS_SCHEMA = '''
+  CREATE TABLE IF NOT EXISTS folder_covers (
+    dir TEXT PRIMARY KEY NOT NULL,
+    dir_mtime_ns INTEGER NOT NULL,
+    image_name TEXT NOT NULL,
+    image_mtime_ns INTEGER NOT NULL,
+    image_size INTEGER NOT NULL,
+    cover_filename TEXT NOT NULL,
+    cover_width INTEGER NOT NULL,
+    cover_height INTEGER NOT NULL,
+    cover_size INTEGER NOT NULL
+  )
+'''
+
+
+# full text index of the tags, kept in sync with audio_files by triggers.
+# prefix indexes make prefix queries as cheap as whole word ones
+SEARCH_SCHEMA = [
+  '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS audio_files_fts USING fts5(
+      artist, title, album,
+      content='audio_files', content_rowid='rowid',
+      tokenize='unicode61 remove_diacritics 2', prefix='2 3'
     )
+  ''',
+  '''
+    CREATE TRIGGER IF NOT EXISTS audio_files_fts_insert AFTER INSERT ON audio_files BEGIN
+      INSERT INTO audio_files_fts(rowid, artist, title, album) VALUES (new.rowid, new.artist, new.title, new.album);
+    END
+  ''',
+  '''
+    CREATE TRIGGER IF NOT EXISTS audio_files_fts_delete AFTER DELETE ON audio_files BEGIN
+      INSERT INTO audio_files_fts(audio_files_fts, rowid, artist, title, album)
+        VALUES ('delete', old.rowid, old.artist, old.title, old.album);
+    END
+  ''',
+  # only when the tags change, most updates just refresh mtime or the cover
+  '''
+    CREATE TRIGGER IF NOT EXISTS audio_files_fts_update AFTER UPDATE OF artist, title, album ON audio_files
+    WHEN old.artist IS NOT new.artist OR old.title IS NOT new.title OR old.album IS NOT new.album BEGIN
+      INSERT INTO audio_files_fts(audio_files_fts, rowid, artist, title, album)
+        VALUES ('delete', old.rowid, old.artist, old.title, old.album);
+      INSERT INTO audio_files_fts(rowid, artist, title, album) VALUES (new.rowid, new.artist, new.title, new.album);
+    END
+  ''',
+]
+
+
+# statements that bring a database from the previous version to the given one
+MIGRATIONS: dict[int, list[str]] = {
+  2: [
+    # cover dimensions used to be read from the jpeg on every request,
+    # rows with 0 are filled in the next time they are loaded
+    'ALTER TABLE audio_files ADD COLUMN cover_width INTEGER DEFAULT 0 NOT NULL',
+    'ALTER TABLE audio_files ADD COLUMN cover_height INTEGER DEFAULT 0 NOT NULL',
+    'ALTER TABLE audio_files ADD COLUMN cover_size INTEGER DEFAULT 0 NOT NULL',
+    # only a lookup cache, recreated with the size column
+    'DROP TABLE IF EXISTS cover_sources',
+    COVER_SOURCES_SCHEMA,
+  ],
+  3: [
+    # covers moved into shard directories, the files are moved on startup by
+    # cover_store.migrate_flat_covers. databases from before folder covers
+    # were cached don't have that table yet
+    FOLDER_COVERS_SCHEMA,
+    _shard_cover_filenames('audio_files'),
+    _shard_cover_filenames('cover_sources'),
+    _shard_cover_filenames('folder_covers'),
+  ],
+  4: [
+    # index the rows that are already there
+    *SEARCH_SCHEMA,
+    "INSERT INTO audio_files_fts(audio_files_fts) VALUES ('rebuild')",
+  ],
+  5: [
+    # rows were validated against the time they were written, existing rows
+    # keep that until they are next written
+    'ALTER TABLE audio_files ADD COLUMN file_mtime_ns INTEGER DEFAULT 0 NOT NULL',
+    'ALTER TABLE audio_files ADD COLUMN file_size INTEGER DEFAULT 0 NOT NULL',
+    'ALTER TABLE audio_files ADD COLUMN file_inode INTEGER DEFAULT 0 NOT NULL',
+  ],
+}
 
 
 if multiprocessing.parent_process() is None:
   logger.info(f'Initialising db...')
-  with db as cur:
+  with get_connection() as cur:
+    # readers don't block on writers (and vice versa) in WAL mode
+    _ = cur.execute('PRAGMA journal_mode = WAL')
     row: sqlite3.Row = cur.execute('PRAGMA user_version').fetchone()
     version: int = row['user_version']
-    if version < DB_VERSION:
+    if 0 < version < DB_VERSION:
+      logger.info(f'migrating database from version {version} to {DB_VERSION}...')
+      for migration_version in range(version + 1, DB_VERSION + 1):
+        for statement in MIGRATIONS[migration_version]:
+          _ = cur.execute(statement)
+      _ = cur.execute(f'PRAGMA user_version = {DB_VERSION}')
+    elif version < DB_VERSION:
       logger.info('old database detected, recreating...')
       _ = cur.execute('DROP TABLE IF EXISTS audio_files')
       _ = cur.execute(f'PRAGMA user_version = {DB_VERSION}')
@@ -81,10 +584,20 @@ if multiprocessing.parent_process() is None:
       CREATE TABLE IF NOT EXISTS audio_files (
         path TEXT PRIMARY KEY NOT NULL,
         mtime INTEGER DEFAULT (unixepoch()) NOT NULL,
+        file_mtime_ns INTEGER DEFAULT 0 NOT NULL,
+        file_size INTEGER DEFAULT 0 NOT NULL,
+        file_inode INTEGER DEFAULT 0 NOT NULL,
         cover_filename TEXT NOT NULL,
+        cover_width INTEGER DEFAULT 0 NOT NULL,
+        cover_height INTEGER DEFAULT 0 NOT NULL,
+        cover_size INTEGER DEFAULT 0 NOT NULL,
         artist TEXT NOT NULL,
         title TEXT NOT NULL,
         album TEXT NOT NULL,
         date TEXT NOT NULL
       )
     ''')
+    _ = cur.execute(COVER_SOURCES_SCHEMA)
+    _ = cur.execute(FOLDER_COVERS_SCHEMA)
+    for statement in SEARCH_SCHEMA:
+      _ = cur.execute(statement)
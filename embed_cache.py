@@ -0,0 +1,89 @@
+import datetime
+import hashlib
+import math
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import PurePosixPath
+
+from aiohttp import web
+from aiohttp.helpers import ETag
+
+import db
+import metrics
+from config import EMBED_CACHE_SIZE, MUSIC_DIR
+from metadata_service import AudioMetadata, folder_cover_is_current
+
+
+@dataclass(frozen=True)
+class EmbedKey:
+  path: str
+  scheme: str
+  host: str
+  mtime_ns: int
+
+
+@dataclass(kw_only=True)
+class CachedEmbed:
+  body: bytes
+  etag: ETag
+  # unix timestamp, rounded up to the second like the Last-Modified header
+  last_modified: int
+  # the folder image can change without the audio file changing, checked on every hit
+  folder_cover: db.FolderCover | None = None
+
+
+# LRU of rendered embed pages, only complete metadata is stored
+_embeds: OrderedDict[EmbedKey, CachedEmbed] = OrderedDict()
+metrics.Gauge('embed_cache_entries', 'Rendered embed pages in the cache.', lambda: len(_embeds), per_process=True)
+
+
+def make_key(rel_path, scheme: str, host: str, stat: os.stat_result) -> EmbedKey:
+  return EmbedKey(path=str(rel_path), scheme=scheme, host=host, mtime_ns=stat.st_mtime_ns)
+
+
+def make_etag(key: EmbedKey, cover_filename: str) -> ETag:
+  version = f'{key.path}\0{key.scheme}\0{key.host}\0{key.mtime_ns}\0{cover_filename}'
+  # weak because the "generated at" footer differs between renders
+  return ETag(value=hashlib.sha256(version.encode()).hexdigest()[:32], is_weak=True)
+
+
+def make_embed(key: EmbedKey, body: bytes, metadata: AudioMetadata) -> CachedEmbed:
+  folder_cover = metadata.folder_cover
+  image_mtime_ns = folder_cover.image_mtime_ns if folder_cover else 0
+  return CachedEmbed(
+    body=body,
+    etag=make_etag(key, metadata.cover_filename),
+    last_modified=math.ceil(max(key.mtime_ns, image_mtime_ns) / 1e9),
+    folder_cover=folder_cover,
+  )
+
+
+def get(key: EmbedKey) -> CachedEmbed | None:
+  embed = _embeds.get(key)
+  if embed and not folder_cover_is_current(MUSIC_DIR / PurePosixPath(key.path).parent, embed.folder_cover):
+    # rendered again once the metadata has the new cover
+    del _embeds[key]
+    embed = None
+  if embed:
+    _embeds.move_to_end(key)
+  metrics.embed_cache_requests.inc('hit' if embed else 'miss')
+  return embed
+
+
+def put(key: EmbedKey, embed: CachedEmbed):
+  if EMBED_CACHE_SIZE <= 0:
+    return
+  _embeds[key] = embed
+  _embeds.move_to_end(key)
+  while len(_embeds) > EMBED_CACHE_SIZE:
+    _embeds.popitem(last=False)
+
+
+def is_not_modified(req: web.Request, embed: CachedEmbed) -> bool:
+  # If-None-Match takes precedence over If-Modified-Since (RFC 9110 13.2.2)
+  if (etags := req.if_none_match) is not None:
+    return any(etag.value in (embed.etag.value, '*') for etag in etags)
+  if (since := req.if_modified_since) is not None:
+    return since >= datetime.datetime.fromtimestamp(embed.last_modified, datetime.timezone.utc)
+  return False
@@ -1,67 +1,450 @@
 import asyncio
+import io
 import logging
+import os
+from collections import OrderedDict
+from collections.abc import Iterator
 from pathlib import Path, PurePosixPath
 import threading
+import time
 
-from config import MUSIC_DIR
+import inotify
+import metrics
+from path_index import PathIndex
+from config import (
+  INDEX_POLL_INTERVAL, INDEX_SNAPSHOT_PATH, INDEX_WATCH, MISSING_PATH_CACHE_SIZE, MISSING_PATH_TTL, MUSIC_DIR,
+  RESCAN_MIN_INTERVAL,
+)
 from metadata_service import ACCEPTED_FILE_EXTS
 
 
-# set of relative file paths that are valid for processing
-discovered_files: set[str] = set()
+# relative file paths that are valid for processing
+discovered_files = PathIndex()
+# relative directory path -> mtime (ns) of every directory seen while indexing
+discovered_dirs: dict[str, int] = {}
 
 scan_lock = threading.Lock()
 logger = logging.getLogger('indexer')
 
+SNAPSHOT_HEADER = f'file-index v2 {MUSIC_DIR}'
+SNAPSHOT_READ_SIZE = 1 << 20
+
+WATCH_MASK = (
+  inotify.IN_CREATE | inotify.IN_DELETE | inotify.IN_MOVED_FROM | inotify.IN_MOVED_TO
+  | inotify.IN_DELETE_SELF | inotify.IN_MOVE_SELF | inotify.IN_ONLYDIR
+)
+
 
 def path_is_valid(relative_path: PurePosixPath):
   return str(relative_path) in discovered_files
 
 
+def path_is_well_formed(relative_path: str):
+  # for paths that didn't come through aiohttp's normalisation. '..' would
+  # leave MUSIC_DIR, '.' and empty segments name an indexed file a second way
+  return all(part not in {'', '.', '..'} for part in relative_path.split('/'))
+
+
 def path_has_valid_extension(local_path: Path):
   return local_path.suffix.lower() in ACCEPTED_FILE_EXTS
 
 
+def _dir_prefix(relative_dir: str):
+  return '' if relative_dir == '.' else f'{relative_dir}/'
+
+
+def _walk(relative_dir: PurePosixPath, files: PathIndex, dirs: dict[str, int]):
+  for root, subdirs, names in (MUSIC_DIR / relative_dir).walk():
+    subdirs.sort()
+    relative_root = root.relative_to(MUSIC_DIR)
+    dirs[str(relative_root)] = root.stat().st_mtime_ns
+    _watch_dir(root, str(relative_root))
+    files.set_dir(str(relative_root), {name for name in names if path_has_valid_extension(PurePosixPath(name))})
+
+
 def _scan_music_dir():
+  global discovered_files, discovered_dirs, full_scans, _last_full_scan
   with scan_lock:
-    global discovered_files
-    _new_files: set[str] = set() if discovered_files else discovered_files
+    start = time.perf_counter()
+    _new_files = PathIndex() if discovered_files else discovered_files
+    _new_dirs: dict[str, int] = {}
     logger.info('rescanning music files...')
-    for root, dirs, files in MUSIC_DIR.walk():
-      dirs.sort()
-      relative_root = root.relative_to(MUSIC_DIR)
-      for file in files:
-        path = relative_root / file
-        if not path_has_valid_extension(path):
-          continue
-        _new_files.add(str(path))
-    logger.info(f'found {len(_new_files)} files')
+    _walk(PurePosixPath('.'), _new_files, _new_dirs)
+    logger.info(f'found {len(_new_files)} files in {len(_new_dirs)} directories')
+    _last_full_scan = time.monotonic()
+    metrics.index_scan_seconds.observe(time.perf_counter() - start, 'full')
     discovered_files = _new_files
+    discovered_dirs = _new_dirs
+    full_scans += 1
+    _forget_missing_paths()
 
 
-def _rescan_if_index_is_outdated(local_path: Path):
-  if not path_has_valid_extension(local_path):
+def _remove_dir(relative_dir: str):
+  prefix = _dir_prefix(relative_dir)
+  discovered_files.remove_tree(relative_dir)
+  for d in [d for d in discovered_dirs if d == relative_dir or d.startswith(prefix)]:
+    del discovered_dirs[d]
+  # a watch left behind would report changes of whatever the directory was
+  # moved to under its old name
+  for wd in [wd for wd, d in watched_dirs.items() if d == relative_dir or d.startswith(prefix)]:
+    del watched_dirs[wd]
+    _inotify.rm_watch(wd)
+
+
+def _update_dir(relative_dir: str, new_dirs: set[str]):
+  # re-list a single directory, walking any new subdirectories. new_dirs are
+  # walked again even if known, they may replace a directory of the same name
+  global incremental_updates
+  local_dir = MUSIC_DIR / relative_dir
+  try:
+    mtime = local_dir.stat().st_mtime_ns
+    entries = list(os.scandir(local_dir))
+  except (FileNotFoundError, NotADirectoryError):
+    _remove_dir(relative_dir)
+    incremental_updates += 1
+    return
+
+  if relative_dir not in discovered_dirs:
+    _watch_dir(local_dir, relative_dir)
+  discovered_dirs[relative_dir] = mtime
+  prefix = _dir_prefix(relative_dir)
+  names: set[str] = set()
+  subdirs: set[str] = set()
+  for entry in entries:
+    path = f'{prefix}{entry.name}'
+    if entry.is_dir():
+      subdirs.add(path)
+      if path in new_dirs and path in discovered_dirs:
+        _remove_dir(path)
+      if path not in discovered_dirs:
+        _walk(PurePosixPath(path), discovered_files, discovered_dirs)
+    elif path_has_valid_extension(PurePosixPath(entry.name)):
+      names.add(entry.name)
+
+  removed_subdirs = [
+    d for d in discovered_dirs
+    if d.startswith(prefix) and d != relative_dir and '/' not in d[len(prefix):] and d not in subdirs
+  ]
+  for d in removed_subdirs:
+    _remove_dir(d)
+  discovered_files.set_dir(relative_dir, names)
+  incremental_updates += 1
+
+
+def _update_dirs(relative_dirs: set[str], new_dirs: set[str] = frozenset()):
+  # new_dirs are subdirectories of relative_dirs that were created or moved in
+  with scan_lock:
+    start = time.perf_counter()
+    for relative_dir in sorted(relative_dirs):
+      _update_dir(relative_dir, new_dirs)
+    metrics.index_scan_seconds.observe(time.perf_counter() - start, 'incremental')
+    _forget_missing_paths()
+  logger.info(f'updated {len(relative_dirs)} changed directories, {len(discovered_files)} files indexed')
+
+
+def _watch_dir(local_dir: Path, relative_dir: str):
+  if _inotify is None:
+    return
+  try:
+    watched_dirs[_inotify.add_watch(local_dir, WATCH_MASK)] = relative_dir
+  except OSError as e:
+    # most likely fs.inotify.max_user_watches, poll whatever we can't watch
+    if not _poll_thread:
+      logger.warning(f'could not watch {local_dir} ({e}), falling back to polling')
+    _start_polling()
+
+
+def _watch_inotify():
+  while True:
+    changed_dirs: set[str] = set()
+    new_dirs: set[str] = set()
+    overflowed = False
+    for event in _inotify.read_events():
+      if event.mask & inotify.IN_Q_OVERFLOW:
+        overflowed = True
+        continue
+      relative_dir = watched_dirs.get(event.wd)
+      if event.mask & inotify.IN_IGNORED:
+        watched_dirs.pop(event.wd, None)
+      if relative_dir is None:
+        continue
+      if event.mask & (inotify.IN_DELETE_SELF | inotify.IN_MOVE_SELF):
+        changed_dirs.add(str(PurePosixPath(relative_dir).parent))
+      else:
+        changed_dirs.add(relative_dir)
+      if event.mask & inotify.IN_ISDIR and event.mask & (inotify.IN_CREATE | inotify.IN_MOVED_TO):
+        # also when the name is known, e.g. 'mv album.new album' or 'rm -r d && mkdir d'
+        new_dirs.add(f'{_dir_prefix(relative_dir)}{event.name}')
+
+    try:
+      if overflowed:
+        logger.warning('inotify queue overflowed, doing a full rescan')
+        _scan_music_dir()
+      elif changed_dirs:
+        _update_dirs(changed_dirs, new_dirs)
+    except:
+      logger.exception('Error updating file index')
+
+
+def _find_changed_dirs() -> set[str]:
+  start = time.perf_counter()
+  changed_dirs: set[str] = set()
+  for relative_dir, mtime in list(discovered_dirs.items()):
+    try:
+      if os.stat(MUSIC_DIR / relative_dir).st_mtime_ns != mtime:
+        changed_dirs.add(relative_dir)
+    except OSError:
+      changed_dirs.add(str(PurePosixPath(relative_dir).parent))
+  metrics.index_scan_seconds.observe(time.perf_counter() - start, 'mtime_check')
+  return changed_dirs
+
+
+def _poll_dirs():
+  while True:
+    time.sleep(INDEX_POLL_INTERVAL)
+    try:
+      if changed_dirs := _find_changed_dirs():
+        _update_dirs(changed_dirs)
+    except:
+      logger.exception('Error updating file index')
+
+
+def _reconcile_snapshot():
+  logger.info(f'checking {len(discovered_dirs)} directories from the index snapshot...')
+  if changed_dirs := _find_changed_dirs():
+    _update_dirs(changed_dirs)
+  logger.info(f'index snapshot is up to date, {len(discovered_files)} files indexed')
+
+
+def _start_polling():
+  global watch_mode, _poll_thread
+  if _poll_thread:
     return
+  watch_mode = 'poll' if watch_mode != 'inotify' else 'inotify+poll'
+  _poll_thread = threading.Thread(target=_poll_dirs, name='index-poll', daemon=True)
+  _poll_thread.start()
+
+
+def _start_watching():
+  global watch_mode, _inotify
+  if INDEX_WATCH in {'auto', 'inotify'}:
+    try:
+      _inotify = inotify.Inotify()
+      watch_mode = 'inotify'
+    except (OSError, AttributeError) as e:
+      logger.warning(f'inotify is not available ({e!r}), falling back to polling')
+  if _inotify:
+    with scan_lock:
+      for relative_dir in list(discovered_dirs):
+        _watch_dir(MUSIC_DIR / relative_dir, relative_dir)
+    threading.Thread(target=_watch_inotify, name='index-inotify', daemon=True).start()
+  else:
+    _start_polling()
+  logger.info(f'watching {len(discovered_dirs)} directories for changes ({watch_mode})')
+
+
+def _forget_missing_paths():
+  # the index changed, so paths known to be missing may exist now. replaced
+  # rather than cleared as the event loop uses it without the lock
+  global _missing_paths
+  _missing_paths = OrderedDict()
+
+
+def _is_known_missing(relative_path: str):
+  if (expires_at := _missing_paths.get(relative_path)) is None:
+    return False
+  if expires_at < time.monotonic():
+    _missing_paths.pop(relative_path, None)
+    return False
+  return True
+
+
+def _remember_missing(relative_path: str):
+  missing_paths = _missing_paths
+  missing_paths[relative_path] = time.monotonic() + MISSING_PATH_TTL
+  missing_paths.move_to_end(relative_path)
+  while len(missing_paths) > MISSING_PATH_CACHE_SIZE:
+    missing_paths.popitem(last=False)
+
+
+def _rescan_if_index_is_outdated(local_path: Path) -> tuple[bool, bool]:
+  # returns whether the path is a file and whether a full rescan is needed
   relative_path = local_path.relative_to(MUSIC_DIR)
   is_indexed = str(relative_path) in discovered_files
   is_file = local_path.is_file()
   if (is_indexed and is_file) or (not is_indexed and not is_file):
+    return is_file, False
+  if watch_mode:
+    # the watcher missed this (or hasn't caught up yet), only re-list the parent
+    _update_dirs({str(relative_path.parent)})
+    return is_file, False
+  if is_file:
+    # servable straight away, the rescan may be held back for a while
+    discovered_files.add(str(relative_path))
+  return is_file, True
+
+
+async def _rescan_when_allowed():
+  global _rescan_task
+  try:
+    await asyncio.sleep(max(0, _last_full_scan + RESCAN_MIN_INTERVAL - time.monotonic()))
+    await asyncio.to_thread(_scan_music_dir)
+  except:
+    logger.exception('Error scanning music directory')
+  finally:
+    _rescan_task = None
+
+
+async def rescan_if_index_is_outdated(local_path: Path):
+  global _rescan_task
+  relative_path = str(local_path.relative_to(MUSIC_DIR))
+  _checks_in_flight.add(relative_path)
+  try:
+    is_file, needs_rescan = await asyncio.to_thread(_rescan_if_index_is_outdated, local_path)
+  finally:
+    _checks_in_flight.discard(relative_path)
+  if not is_file:
+    _remember_missing(relative_path)
+  if not needs_rescan:
     return
-  discovered_files.add(str(relative_path))
-  if scan_lock.locked():
-    logger.info('need to rescan but a scan is already in progress, skipping')
+  if _rescan_task or scan_lock.locked():
+    metrics.suppressed_path_checks.inc('rescan_pending')
     return
-  _scan_music_dir()
+  _rescan_task = asyncio.create_task(_rescan_when_allowed())
 
 
-async def rescan_if_index_is_outdated(local_path: Path):
-  await asyncio.to_thread(_rescan_if_index_is_outdated, local_path)
+def check_unindexed_path(local_path: Path):
+  # called for requests of paths that aren't in the index. paths that can't be
+  # audio files, were recently found missing or are being checked already are
+  # dropped here, without a thread. the rest are checked in the background
+  if not path_has_valid_extension(local_path):
+    metrics.suppressed_path_checks.inc('extension')
+    return
+  relative_path = str(local_path.relative_to(MUSIC_DIR))
+  # relative_to doesn't resolve '..', the rescan would index outside MUSIC_DIR
+  if not path_is_well_formed(relative_path):
+    metrics.suppressed_path_checks.inc('malformed')
+    return
+  if _is_known_missing(relative_path):
+    metrics.suppressed_path_checks.inc('missing')
+    return
+  if relative_path in _checks_in_flight:
+    metrics.suppressed_path_checks.inc('in_flight')
+    return
+  asyncio.create_task(rescan_if_index_is_outdated(local_path))
+
+
+def _read_records(f: io.TextIOBase) -> Iterator[str]:
+  # the '\0\0' separated records of a snapshot, read a chunk at a time
+  buf = ''
+  while chunk := f.read(SNAPSHOT_READ_SIZE):
+    *records, buf = (buf + chunk).split('\0\0')
+    yield from records
+  yield buf
+
+
+def load_snapshot():
+  # loads the index saved by the last run, so requests are valid while we rescan
+  global discovered_files, discovered_dirs, snapshot_version
+  files = PathIndex()
+  dirs: dict[str, int] = {}
+  try:
+    with open(INDEX_SNAPSHOT_PATH, encoding='utf-8', errors='surrogateescape', newline='') as f:
+      records = _read_records(f)
+      if next(records) != SNAPSHOT_HEADER:
+        logger.info('index snapshot is from a different music directory or version, ignoring it')
+        return False
+      for entry in filter(None, next(records).split('\0')):
+        mtime, relative_dir = entry.split('\t', 1)
+        dirs[relative_dir] = int(mtime)
+      # one record per directory: its path, then the names of its files
+      for record in records:
+        relative_dir, _, names = record.partition('\0')
+        files.set_dir(relative_dir, set(names.split('\0')))
+  except FileNotFoundError:
+    return False
+  except:
+    logger.exception('Error reading index snapshot, ignoring it')
+    return False
+
+  discovered_dirs = dirs
+  discovered_files = files
+  snapshot_version = full_scans + incremental_updates
+  logger.info(f'loaded {len(discovered_files)} files from index snapshot')
+  return True
+
+
+def _save_snapshot():
+  # written a directory at a time from the packed names, so saving never holds
+  # every path as a string of its own
+  global snapshot_version
+  with scan_lock:
+    version = full_scans + incremental_updates
+    dirs = '\0'.join(f'{mtime}\t{d}' for d, mtime in discovered_dirs.items())
+    files = list(discovered_files.iter_dirs())
+  tmp_path = INDEX_SNAPSHOT_PATH.with_name(f'{INDEX_SNAPSHOT_PATH.name}.tmp')
+  with open(tmp_path, 'w', encoding='utf-8', errors='surrogateescape', newline='') as f:
+    f.write(SNAPSHOT_HEADER)
+    f.write('\0\0')
+    f.write(dirs)
+    for relative_dir, packed_names in files:
+      # packed names start and end with '\0', which makes up the separators
+      f.write('\0\0')
+      f.write(relative_dir)
+      f.write(packed_names[:-1])
+  os.replace(tmp_path, INDEX_SNAPSHOT_PATH)
+  snapshot_version = version
+  logger.info(f'saved index snapshot with {len(discovered_files)} files')
+
+
+async def save_snapshot():
+  if snapshot_version == full_scans + incremental_updates:
+    return
+  try:
+    await asyncio.to_thread(_save_snapshot)
+  except:
+    logger.exception('Error saving index snapshot')
 
 
 async def scan_music_dir():
   try:
-    await asyncio.to_thread(_scan_music_dir)
-    return True
+    if discovered_dirs:
+      # loaded from a snapshot, only re-list what changed since then
+      await asyncio.to_thread(_reconcile_snapshot)
+    else:
+      await asyncio.to_thread(_scan_music_dir)
   except:
     logger.exception('Error scanning music directory')
-  return False
\ No newline at end of file
+    return False
+  await save_snapshot()
+  return True
+
+
+async def start_watching():
+  if INDEX_WATCH == 'off' or watch_mode:
+    return
+  await asyncio.to_thread(_start_watching)
+
+
+# how the index is kept up to date after the initial scan, None for full rescans only
+watch_mode: str | None = None
+_inotify: inotify.Inotify | None = None
+_poll_thread: threading.Thread | None = None
+# inotify watch descriptor -> relative directory path
+watched_dirs: dict[int, str] = {}
+
+full_scans = 0
+incremental_updates = 0
+# value of full_scans + incremental_updates when the snapshot was last loaded/saved
+snapshot_version = -1
+
+# relative paths that weren't files when last checked -> when that expires
+_missing_paths: OrderedDict[str, float] = OrderedDict()
+_checks_in_flight: set[str] = set()
+# time.monotonic() of the last full scan, and the scan waiting for RESCAN_MIN_INTERVAL
+_last_full_scan = 0.0
+_rescan_task: asyncio.Task | None = None
+
+metrics.Gauge('index_files', 'Audio files in the file index.', lambda: len(discovered_files))
+metrics.Gauge('index_dirs', 'Directories in the file index.', lambda: len(discovered_dirs))
+metrics.Gauge('index_missing_paths', 'Paths remembered as not being files.', lambda: len(_missing_paths))
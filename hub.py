@@ -0,0 +1,159 @@
+import asyncio
+import itertools
+import logging
+import os
+import pickle
+import struct
+from functools import partial
+from pathlib import Path, PurePosixPath
+
+import file_indexer
+import metadata_service
+import metrics
+from config import MUSIC_DIR
+from metadata_service import AudioMetadata
+
+
+logger = logging.getLogger('hub')
+# messages are pickled and prefixed with their length
+HEADER = struct.Struct('!I')
+
+
+class LocalBackend:
+  # what the http server needs from the process that owns the file index and
+  # metadata pool. used directly when running in a single process, otherwise
+  # the hub serves it to the http worker processes through HubClient
+
+  async def get_audio_metadata(self, rel_path: PurePosixPath, uuid: str, timeout: float) -> AudioMetadata:
+    return await metadata_service.get_audio_metadata(rel_path, uuid=uuid, timeout=timeout)
+
+  async def check_path(self, rel_path: PurePosixPath) -> bool:
+    if file_indexer.path_is_valid(rel_path):
+      return True
+    file_indexer.check_unindexed_path(MUSIC_DIR / rel_path)
+    return False
+
+  async def render_metrics(self, source: str | None = None, state: dict | None = None) -> str:
+    if source is not None:
+      metrics.remote_states[source] = state
+    metrics.observe_local_db_flushes()
+    return metrics.render()
+
+
+METHODS = {'get_audio_metadata', 'check_path', 'render_metrics'}
+
+
+async def _read_message(reader: asyncio.StreamReader):
+  header = await reader.readexactly(HEADER.size)
+  return pickle.loads(await reader.readexactly(HEADER.unpack(header)[0]))
+
+
+def _write_message(writer: asyncio.StreamWriter, message):
+  data = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+  writer.write(HEADER.pack(len(data)) + data)
+
+
+async def _handle_call(backend: LocalBackend, writer: asyncio.StreamWriter, call_id: int, method: str, args: tuple):
+  try:
+    if method not in METHODS:
+      raise AttributeError(f'unknown hub method {method}')
+    reply = (call_id, True, await getattr(backend, method)(*args))
+  except Exception as e:
+    reply = (call_id, False, e)
+  try:
+    _write_message(writer, reply)
+  except (pickle.PicklingError, TypeError, AttributeError) as e:
+    _write_message(writer, (call_id, False, RuntimeError(f'unpicklable hub reply: {e!r}')))
+
+
+async def _handle_client(backend: LocalBackend, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+  # calls are handled concurrently, replies are matched up by call id
+  tasks: set[asyncio.Task] = set()
+  try:
+    while True:
+      call_id, method, args = await _read_message(reader)
+      task = asyncio.create_task(_handle_call(backend, writer, call_id, method, args))
+      tasks.add(task)
+      task.add_done_callback(tasks.discard)
+  except (asyncio.IncompleteReadError, ConnectionError):
+    pass
+  finally:
+    for task in tasks:
+      task.cancel()
+    writer.close()
+
+
+async def serve(path: Path, backend: LocalBackend) -> asyncio.Server:
+  path.unlink(missing_ok=True)
+  server = await asyncio.start_unix_server(partial(_handle_client, backend), path)
+  # replies are unpickled by the workers, only they should be able to connect
+  os.chmod(path, 0o600)
+  return server
+
+
+class HubClient:
+  def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    self.reader = reader
+    self.writer = writer
+    self.call_ids = itertools.count()
+    self.pending: dict[int, asyncio.Future] = {}
+    # set when the connection to the hub is lost
+    self.closed = asyncio.Event()
+    self.reader_task = asyncio.create_task(self._read_replies())
+
+  @classmethod
+  async def connect(cls, path: Path, timeout: float = 30):
+    # the hub may still be starting up
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+      try:
+        return cls(*await asyncio.open_unix_connection(path))
+      except (FileNotFoundError, ConnectionRefusedError):
+        if loop.time() > deadline:
+          raise
+        await asyncio.sleep(0.1)
+
+  async def _read_replies(self):
+    try:
+      while True:
+        call_id, ok, result = await _read_message(self.reader)
+        future = self.pending.pop(call_id, None)
+        if future is None or future.done():
+          continue
+        if ok:
+          future.set_result(result)
+        else:
+          future.set_exception(result)
+    except (asyncio.IncompleteReadError, ConnectionError):
+      logger.error('lost connection to the hub')
+    finally:
+      for future in self.pending.values():
+        if not future.done():
+          future.set_exception(ConnectionError('lost connection to the hub'))
+      self.pending.clear()
+      self.closed.set()
+
+  async def _call(self, method: str, *args):
+    if self.closed.is_set():
+      raise ConnectionError('lost connection to the hub')
+    call_id = next(self.call_ids)
+    future = self.pending[call_id] = asyncio.get_running_loop().create_future()
+    _write_message(self.writer, (call_id, method, args))
+    try:
+      return await future
+    finally:
+      self.pending.pop(call_id, None)
+
+  async def get_audio_metadata(self, rel_path: PurePosixPath, uuid: str, timeout: float) -> AudioMetadata:
+    return await self._call('get_audio_metadata', rel_path, uuid, timeout)
+
+  async def check_path(self, rel_path: PurePosixPath) -> bool:
+    if not await self._call('check_path', rel_path):
+      return False
+    # the local copy of the index is behind the hub's, until the next reload
+    file_indexer.discovered_files.add(str(rel_path))
+    return True
+
+  async def render_metrics(self, source: str | None = None, state: dict | None = None) -> str:
+    return await self._call('render_metrics', source, state)
@@ -0,0 +1,76 @@
+import ctypes
+import ctypes.util
+import os
+import struct
+from dataclasses import dataclass
+
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+@dataclass(frozen=True)
+class Event:
+  wd: int
+  mask: int
+  cookie: int
+  name: str
+
+
+def _load_libc():
+  libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+  # raises AttributeError on platforms without inotify
+  for fn in (libc.inotify_init1, libc.inotify_add_watch, libc.inotify_rm_watch):
+    fn.restype = ctypes.c_int
+  libc.inotify_add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+  return libc
+
+
+class Inotify:
+  def __init__(self):
+    self._libc = _load_libc()
+    self.fd = self._libc.inotify_init1(IN_CLOEXEC)
+    if self.fd < 0:
+      errno = ctypes.get_errno()
+      raise OSError(errno, os.strerror(errno))
+
+  def add_watch(self, path: os.PathLike, mask: int) -> int:
+    wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+    if wd < 0:
+      errno = ctypes.get_errno()
+      raise OSError(errno, os.strerror(errno), str(path))
+    return wd
+
+  def rm_watch(self, wd: int):
+    # fails if the watch is already gone, e.g. its directory was deleted
+    self._libc.inotify_rm_watch(self.fd, wd)
+
+  def read_events(self) -> list[Event]:
+    # blocks until at least one event is available
+    buf = os.read(self.fd, 64 * 1024)
+    events: list[Event] = []
+    offset = 0
+    while offset < len(buf):
+      wd, mask, cookie, name_len = _EVENT_HEADER.unpack_from(buf, offset)
+      offset += _EVENT_HEADER.size
+      name = os.fsdecode(buf[offset:offset + name_len].rstrip(b'\0'))
+      offset += name_len
+      events.append(Event(wd=wd, mask=mask, cookie=cookie, name=name))
+    return events
+
+  def close(self):
+    os.close(self.fd)
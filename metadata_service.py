@@ -2,64 +2,61 @@ import logging
 import asyncio
 import concurrent.futures
 import hashlib
+import itertools
 import multiprocessing
-from dataclasses import dataclass
+import multiprocessing.queues
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
 from functools import partial
 from io import BytesIO
-from multiprocessing.managers import BaseManager
 from pathlib import Path, PurePosixPath
 from copy import deepcopy
 
-import mutagen
 from PIL import Image
 
+import cover_store
 import db
-from db import CachedAudioMetadata
-from config import COVER_DIR, DEFAULT_COVER_PATH, MUSIC_DIR, METADATA_WORKERS
-from metadata_tags import Tags, read_audio_tags
+import metrics
+from db import CachedAudioMetadata, Cover
+from config import (
+  COVER_DIR, COVER_FAST_RESAMPLE, COVER_RESIZE_MODE, DEFAULT_COVER_PATH, MUSIC_DIR, METADATA_CACHE_SIZE,
+  METADATA_QUEUE_LIMIT, METADATA_WORKERS, VERIFY_CACHED_COVERS,
+)
+from metadata_tags import Tags, read_audio_file
 
 
 ACCEPTED_FILE_EXTS = {'.flac', '.mp3'}
 COVER_SIZE = 512
+FOLDER_IMAGE_EXTS = {'.jpg', '.jpeg', '.png'}
+# folder images with these names are preferred (in this order) over other images
+FOLDER_IMAGE_NAMES = ('cover', 'folder', 'front')
+# weight of the latest job in the moving average of job durations
+JOB_DURATION_SMOOTHING = 0.1
 
 logger = logging.getLogger('meta:main')
 
 
-def _mp_init():
-  global logger
+def _mp_init(queue: multiprocessing.queues.SimpleQueue):
+  global logger, result_queue
   current_proc = multiprocessing.current_process()
   logger = logging.getLogger(f'meta:{current_proc.name}')
+  result_queue = queue
   import file_indexer
-  file_indexer.discovered_files = set()
-
-
-@dataclass
-class ResultWrapper[T]:
-  _result: T | None = None
-
-  def set(self, value: T):
-    self._result = value
-
-  def get(self) -> T | None:
-    return self._result
-
-
-class MpManager(BaseManager):
-  pass
-
-
-@dataclass(kw_only=True)
-class Cover:
-  filename: str
-  width: int
-  height: int
+  from path_index import PathIndex
+  file_indexer.discovered_files = PathIndex()
 
 
 @dataclass(kw_only=True)
 class AudioMetadata(CachedAudioMetadata):
-  cover_width: int = 0
-  cover_height: int = 0
   is_complete: bool = False
+  # the directory's cover row the result was checked against, None if the
+  # folder wasn't looked at. rendered pages are revalidated against it
+  folder_cover: db.FolderCover | None = None
+  # timings etc. of the job that produced this, only set on final results
+  stats: metrics.JobStats | None = None
 
   @classmethod
   def create_placeholder(cls, path: PurePosixPath):
@@ -68,33 +65,73 @@ class AudioMetadata(CachedAudioMetadata):
       cover_filename=DEFAULT_COVER.filename,
       cover_width=DEFAULT_COVER.width,
       cover_height=DEFAULT_COVER.height,
+      cover_size=DEFAULT_COVER.size,
       tags=Tags(title=path.stem)
     )
 
 
-def get_embedded_art(f):
-  m = mutagen.File(f)
-  pics = []
-  if isinstance(m, mutagen.flac.FLAC):
-    pics = [p.data for p in m.pictures]
-  elif isinstance(m, mutagen.mp3.MP3):
-    pics = [m.get(k).data for k in m.keys() if k.startswith('APIC:')]
-  else:
-    raise NotImplementedError
-  return pics
-
-
-def get_cover_art_image(f, read_tags=True):
-  if read_tags:
-    covers = get_embedded_art(f)
-    if covers:
-      return Image.open(BytesIO(covers[0])), None
-  # find first image in the same directory
-  parent = Path(f).parent
-  for image_path in parent.glob('*.*'):
-    if image_path.suffix.lower() in {'.jpg', '.jpeg', '.png'}:
-      return Image.open(image_path), image_path
-  return None, None
+def find_folder_image(local_dir: Path) -> os.DirEntry | None:
+  def preference(entry: os.DirEntry):
+    stem = Path(entry.name).stem.lower()
+    rank = FOLDER_IMAGE_NAMES.index(stem) if stem in FOLDER_IMAGE_NAMES else len(FOLDER_IMAGE_NAMES)
+    return rank, entry.name
+
+  with metrics.stage('stat'), os.scandir(local_dir) as entries:
+    images = [
+      entry for entry in entries
+      if Path(entry.name).suffix.lower() in FOLDER_IMAGE_EXTS and entry.is_file()
+    ]
+  return min(images, key=preference, default=None)
+
+
+def get_folder_cover(local_dir: Path) -> tuple[db.FolderCover, Path | None, float]:
+  relative_dir = str(local_dir.relative_to(MUSIC_DIR))
+  with metrics.stage('stat'):
+    dir_mtime_ns = local_dir.stat().st_mtime_ns
+  with metrics.stage('db_lookup'):
+    cached = db.get_folder_cover(relative_dir)
+  if cached and cached.dir_mtime_ns == dir_mtime_ns:
+    if not cached.image_name:
+      return cached, None, 0
+    image_path = local_dir / cached.image_name
+    try:
+      with metrics.stage('stat'):
+        image_stat = image_path.stat()
+        is_unchanged = (
+          (image_stat.st_mtime_ns, image_stat.st_size) == (cached.image_mtime_ns, cached.image_size)
+          and (not VERIFY_CACHED_COVERS or (COVER_DIR / cached.cover.filename).exists())
+        )
+      if is_unchanged:
+        return cached, image_path, image_stat.st_mtime
+    except FileNotFoundError:
+      pass
+
+  folder_cover = db.FolderCover(dir=relative_dir, dir_mtime_ns=dir_mtime_ns)
+  image_path, image_mtime = None, 0
+  if entry := find_folder_image(local_dir):
+    image_path = Path(entry.path)
+    image_stat = entry.stat()
+    image_mtime = image_stat.st_mtime
+    folder_cover.image_name = entry.name
+    folder_cover.image_mtime_ns = image_stat.st_mtime_ns
+    folder_cover.image_size = image_stat.st_size
+    with metrics.stage('art_extraction'):
+      data = image_path.read_bytes()
+    folder_cover.cover = store_cover_art(data)
+  with metrics.stage('db_write'):
+    db.store_folder_cover(folder_cover)
+  return folder_cover, image_path, image_mtime
+
+
+def get_cover_art(
+  f: Path, embedded_art: bytes | None, file_mtime: float
+) -> tuple[Cover | None, Path | None, float, db.FolderCover | None]:
+  # returns the cover, the image file it came from (if any), that file's mtime
+  # and the folder cover row if the folder was looked at
+  if embedded_art:
+    return store_cover_art(embedded_art), None, file_mtime, None
+  folder_cover, image_path, image_mtime = get_folder_cover(f.parent)
+  return folder_cover.cover, image_path, image_mtime, folder_cover
 
 
 def read_image_size(path):
@@ -102,122 +139,450 @@ def read_image_size(path):
   return im.size
 
 
-def resize_and_store_image(im: Image.Image) -> Cover:
-  im_hash = hashlib.sha256(im.tobytes()).hexdigest()
-  filename = f'{im_hash}.jpg'
-  out_path = COVER_DIR / filename
+def get_cover_size(width: int, height: int) -> tuple[int, int]:
+  size_ratio = min(COVER_SIZE/width, COVER_SIZE/height)
+  return round(width * size_ratio), round(height * size_ratio)
 
-  if out_path.exists():
-    width, height = read_image_size(out_path)
-    return Cover(filename=filename, width=width, height=height)
 
-  im = im.convert('RGB')
-  width, height = im.size
-  size_ratio = min(COVER_SIZE/width, COVER_SIZE/height)
-  width, height = round(width * size_ratio), round(height * size_ratio)
-  im = im.resize((width, height), resample=Image.Resampling.LANCZOS, reducing_gap=2.0)
+def resize_and_store_image(im: Image.Image, source_hash: str) -> Cover:
+  # covers are named by the sha256 of the encoded source image, which (unlike
+  # the decoded pixels) doesn't depend on COVER_RESIZE_MODE. the output size
+  # only depends on the source size, no need to open the stored cover
+  width, height = get_cover_size(*im.size)
+  filename = cover_store.get_cover_filename(source_hash)
+  out_path = COVER_DIR / filename
 
-  im_data = BytesIO()
-  im.save(im_data, format='JPEG', quality=95)
-  im_data.seek(0)
+  try:
+    return Cover(filename=filename, width=width, height=height, size=out_path.stat().st_size)
+  except FileNotFoundError:
+    pass
+
+  with metrics.stage('image_decode'):
+    if COVER_RESIZE_MODE == 'fast':
+      # JPEGs are decoded at the smallest scale that is still at least the cover size
+      im.draft(None, (width, height))
+    im.load()
+  with metrics.stage('resize'):
+    im = im.convert('RGB')
+    im = im.resize((width, height), resample=RESIZE_FILTER, reducing_gap=2.0)
+
+  with metrics.stage('jpeg_encode'):
+    im_data = BytesIO()
+    im.save(im_data, format='JPEG', quality=95)
+    im_data.seek(0)
  
+  out_path.parent.mkdir(parents=True, exist_ok=True)
   try:
     with open(out_path, 'xb') as f:
       f.write(im_data.getbuffer())
   except FileExistsError:
     pass
-  return Cover(filename=filename, width=width, height=height)
+  return Cover(filename=filename, width=width, height=height, size=im_data.getbuffer().nbytes)
+
+
+def store_image_file(path: Path) -> Cover:
+  data = path.read_bytes()
+  return resize_and_store_image(Image.open(BytesIO(data)), hashlib.sha256(data).hexdigest())
+
+
+def store_cover_art(data: bytes) -> Cover:
+  with metrics.stage('art_extraction'):
+    source_hash = hashlib.sha256(data).hexdigest()
+  with metrics.stage('db_lookup'):
+    cover = db.get_cover_by_source_hash(source_hash)
+    if cover and (COVER_DIR / cover.filename).exists():
+      return cover
+  with metrics.stage('image_decode'):
+    im = Image.open(BytesIO(data))
+  cover = resize_and_store_image(im, source_hash)
+  with metrics.stage('db_write'):
+    db.store_cover_source(source_hash, cover)
+  return cover
 
 
 def store_audio_file_metadata(metadata: AudioMetadata):
   metadata = deepcopy(metadata)
-  metadata.cover_filename = metadata.cover_filename if metadata.cover_filename != DEFAULT_COVER.filename else ''
-  db.store_audio_metadata(metadata)
+  if metadata.cover_filename == DEFAULT_COVER.filename:
+    metadata.cover_filename = ''
+    metadata.cover_width = metadata.cover_height = metadata.cover_size = 0
+  with metrics.stage('db_write'):
+    db.store_audio_metadata(metadata)
+
+
+def cache_matches_stat(cache: CachedAudioMetadata | db.FileStat, stat: os.stat_result) -> bool:
+  # a file with the same mtime, size and inode hasn't been changed or replaced
+  if cache.file_mtime_ns:
+    return (cache.file_mtime_ns, cache.file_size, cache.file_inode) == (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+  # rows from before file stats were stored only have the time they were written
+  return (cache.mtime or 0) > stat.st_mtime
+
+
+def set_file_stat(metadata: CachedAudioMetadata, stat: os.stat_result):
+  metadata.file_mtime_ns = stat.st_mtime_ns
+  metadata.file_size = stat.st_size
+  metadata.file_inode = stat.st_ino
+
+
+def _publish_partial_result(job_id: int, metadata: AudioMetadata):
+  # one-way write to the result pipe, the main process keeps the latest one
+  result_queue.put((job_id, metadata))
+
+
+def _get_audio_metadata(job_id: int, metadata: AudioMetadata, rel_path: PurePosixPath, uuid: str):
+  # lets the main process know the job has left the pool's queue
+  result_queue.put((job_id, None))
+  metrics.start_job()
+  metadata = _read_audio_metadata(job_id, metadata, rel_path, uuid)
+  metadata.stats = metrics.finish_job()
+  return metadata
 
 
-def _get_audio_metadata(res: ResultWrapper[AudioMetadata], rel_path: PurePosixPath, uuid: str):
-  metadata = res.get()
-  assert metadata is not None
+def _read_audio_metadata(job_id: int, metadata: AudioMetadata, rel_path: PurePosixPath, uuid: str):
+  publish = partial(_publish_partial_result, job_id)
   metadata.path = str(rel_path)
-  cache = db.get_audio_metadata_by_path(rel_path)
+  needs_cover_size = False
+  with metrics.stage('db_lookup'):
+    cache = db.get_audio_metadata_by_path(rel_path)
   if cache:
     logger.info(f'[{uuid}] loading metadata from cache')
     # load from cache, even if it is potentialy outdated
     metadata.tags = cache.tags
-    res.set(metadata)
+    publish(metadata)
 
-    if cache.cover_filename:
+    if cache.cover_filename and cache.cover_width:
+      with metrics.stage('stat'):
+        cover_exists = not VERIFY_CACHED_COVERS or (COVER_DIR / cache.cover_filename).exists()
+      if cover_exists:
+        metadata.cover_filename = cache.cover_filename
+        metadata.cover_width = cache.cover_width
+        metadata.cover_height = cache.cover_height
+        metadata.cover_size = cache.cover_size
+        metadata.is_complete = True
+        publish(metadata)
+      else:
+        logger.warning(f'[{uuid}] cached cover missing!')
+    elif cache.cover_filename:
+      # row from before cover sizes were stored, fill it in from the jpeg once
       try:
-        width, height = read_image_size(COVER_DIR / cache.cover_filename)
+        cover_path = COVER_DIR / cache.cover_filename
+        width, height = read_image_size(cover_path)
         metadata.cover_filename = cache.cover_filename
         metadata.cover_width = width
         metadata.cover_height = height
+        metadata.cover_size = cover_path.stat().st_size
         metadata.is_complete = True
-        res.set(metadata)
+        needs_cover_size = True
+        publish(metadata)
       except FileNotFoundError:
         logger.warning(f'[{uuid}] cached cover missing!')
       except:
         logger.exception(f'[{uuid}] error reading cached cover!')
 
   local_path = Path(MUSIC_DIR) / rel_path
-  stat = local_path.stat()
+  with metrics.stage('stat'):
+    stat = local_path.stat()
+  set_file_stat(metadata, stat)
 
   cache_mtime = (cache.mtime or 0) if cache and metadata.is_complete else 0
-  cache_is_valid = cache and cache_mtime > stat.st_mtime
-
-  # read and resize cover (only read tags is cache is outdated)
-  cover_art_im, cover_art_path = get_cover_art_image(local_path, read_tags=not cache_is_valid)
-  # only process cover if it's newer than the cache
-  cover_art_mtime = Path(cover_art_path).stat().st_mtime if cover_art_path else 0
-  if cover_art_im and cover_art_mtime >= cache_mtime:
+  cache_is_valid = cache and metadata.is_complete and cache_matches_stat(cache, stat)
+  metrics.job_stats.cache_result = 'hit' if cache_is_valid else 'stale' if cache else 'miss'
+
+  embedded_art = None
+  if not cache_is_valid:
+    # tags and embedded art are read together, so the file is only parsed once
+    # (pulling the picture out of the tags is timed as part of tag_parse)
+    logger.info(f'[{uuid}] fetching file metadata')
+    with metrics.stage('tag_parse'):
+      metadata.tags, embedded_art = read_audio_file(local_path)
+    publish(metadata)
+
+  # read and resize cover (only read embedded art if cache is outdated)
+  cover, cover_art_path, cover_art_mtime, metadata.folder_cover = get_cover_art(local_path, embedded_art, stat.st_mtime)
+  # only use cover if it's newer than the cache
+  if cover and cover_art_mtime >= cache_mtime:
     logger.info(f'[{uuid}] updating cover art from {cover_art_path or '<tags>'}')
-    cover = resize_and_store_image(cover_art_im)
     metadata.cover_filename = cover.filename
     metadata.cover_width = cover.width
     metadata.cover_height = cover.height
-    res.set(metadata)
+    metadata.cover_size = cover.size
+    publish(metadata)
     store_audio_file_metadata(metadata)
+    needs_cover_size = False
 
   if cache_is_valid:
     # cache is newer than file, nothing to do
-    return
+    if needs_cover_size or not cache.file_mtime_ns:
+      store_audio_file_metadata(metadata)
+    return metadata
 
-  # read metadata
-  logger.info(f'[{uuid}] fetching file metadata')
-  metadata.tags = read_audio_tags(local_path)
   metadata.is_complete = True
-  res.set(metadata)
 
   store_audio_file_metadata(metadata)
+  return metadata
 
 
-async def get_audio_metadata(rel_path: PurePosixPath, uuid: str, timeout: float) -> AudioMetadata:
-  res: ResultWrapper[AudioMetadata] = manager.ResultWrapper()
+@dataclass(kw_only=True)
+class CachedEntry:
+  metadata: AudioMetadata
+  # to check the folder image hasn't changed since, None if there wasn't a row
+  folder_cover: db.FolderCover | None
+
+
+@dataclass(kw_only=True)
+class MetadataJob:
+  id: int = field(default_factory=partial(next, itertools.count()))
+  future: asyncio.Future[AudioMetadata] | None = None
+  # latest partial result sent by the worker
+  partial_result: AudioMetadata
+  queued_at: float = field(default_factory=time.monotonic)
+  # set when a pool worker picks the job up
+  started_at: float | None = None
+
+  def get(self) -> AudioMetadata:
+    if self.future.done() and not self.future.cancelled() and not self.future.exception():
+      return self.future.result()
+    return self.partial_result
+
+
+def _read_partial_results():
+  while True:
+    job_id, metadata = result_queue.get()
+    if not (job := jobs_by_id.get(job_id)):
+      continue
+    if metadata is None:
+      job.started_at = time.monotonic()
+    else:
+      job.partial_result = metadata
+
+
+def _on_job_done(path: str, job_id: int, future: asyncio.Future[AudioMetadata]):
+  global average_job_seconds
+  in_flight_jobs.pop(path, None)
+  cached_entries.pop(path, None)
+  jobs_by_id.pop(job_id, None)
+  if future.cancelled():
+    return
+  # waiters may have all timed out, so make sure errors still get seen
+  if e := future.exception():
+    logger.debug(f'metadata job for {path} failed: {e!r}')
+    return
+  # the job's db write waits in the worker's write-behind queue, until it's
+  # flushed only this entry keeps the next request from starting another job
+  if (metadata := future.result()).is_complete:
+    _remember_entry(path, CachedEntry(metadata=metadata, folder_cover=metadata.folder_cover))
+  if stats := future.result().stats:
+    average_job_seconds += (stats.seconds - average_job_seconds) * JOB_DURATION_SMOOTHING
+    metrics.observe_job(stats)
+
+
+def _queued_jobs() -> list[MetadataJob]:
+  return [job for job in jobs_by_id.values() if job.started_at is None]
+
+
+def _oldest_queued_job_age() -> float:
+  now = time.monotonic()
+  return max((now - job.queued_at for job in _queued_jobs()), default=0)
+
+
+def _should_shed(timeout: float | None) -> bool:
+  # a job waits for every queued job to be picked up, then runs itself
+  if timeout is None:
+    return False
+  queued = len(_queued_jobs())
+  if queued >= METADATA_QUEUE_LIMIT:
+    return True
+  return (queued // METADATA_WORKERS + 1) * average_job_seconds > timeout
+
+
+def _start_job(rel_path: PurePosixPath, uuid: str) -> MetadataJob:
+  job = MetadataJob(partial_result=AudioMetadata.create_placeholder(rel_path))
   loop = asyncio.get_running_loop()
-  res.set(AudioMetadata.create_placeholder(rel_path))
+  fn = partial(
+    _get_audio_metadata,
+    job_id=job.id, metadata=job.partial_result, rel_path=rel_path, uuid=uuid
+  )
+  job.future = loop.run_in_executor(process_pool, fn)
+  in_flight_jobs[str(rel_path)] = job
+  jobs_by_id[job.id] = job
+  job.future.add_done_callback(partial(_on_job_done, str(rel_path), job.id))
+  return job
+
+
+async def get_audio_metadata(rel_path: PurePosixPath, uuid: str, timeout: float) -> AudioMetadata:
+  global coalesced_requests
+  if job := in_flight_jobs.get(str(rel_path)):
+    coalesced_requests += 1
+    logger.info(f'[{uuid}] joining in-flight job ({coalesced_requests} coalesced so far)')
+  elif metadata := await _get_cached_metadata(str(rel_path)):
+    return metadata
+  elif job := in_flight_jobs.get(str(rel_path)):
+    # started while the db was being read
+    coalesced_requests += 1
+  elif _should_shed(timeout):
+    metrics.metadata_rejections.inc()
+    logger.info(f'[{uuid}] metadata queue is full, answering with a placeholder')
+    return AudioMetadata.create_placeholder(rel_path)
+  else:
+    job = _start_job(rel_path, uuid)
   try:
-    fn = partial(_get_audio_metadata, res=res, rel_path=rel_path, uuid=uuid)
-    await asyncio.wait_for(loop.run_in_executor(process_pool, fn), timeout=timeout)
+    # shield so a timeout doesn't cancel the job for the other waiters
+    await asyncio.wait_for(asyncio.shield(job.future), timeout=timeout)
   except asyncio.TimeoutError:
+    metrics.metadata_timeouts.inc()
     logger.info(f'[{uuid}] timeout={timeout} reached while fetching metadata')
-  return res.get()
+  return job.get()
+
+
+def folder_cover_is_current(local_dir: Path, folder_cover: db.FolderCover | None):
+  # the folder image can change without the audio file changing
+  if folder_cover is None:
+    return True
+  try:
+    if local_dir.stat().st_mtime_ns != folder_cover.dir_mtime_ns:
+      return False
+    if folder_cover.image_name:
+      image_stat = (local_dir / folder_cover.image_name).stat()
+      return (image_stat.st_mtime_ns, image_stat.st_size) == (folder_cover.image_mtime_ns, folder_cover.image_size)
+  except FileNotFoundError:
+    return False
+  return True
+
+
+def _cache_entry_is_current(
+  path: str, cache: CachedAudioMetadata, folder_cover: db.FolderCover | None, dir_is_current: dict[str, bool]
+):
+  # checked like _read_audio_metadata does, dir_is_current remembers the folder
+  # cover checks for other files in the same directory
+  if not cache.cover_filename or not cache.cover_width:
+    return False
+  local_path = MUSIC_DIR / path
+  try:
+    if not cache_matches_stat(cache, local_path.stat()):
+      return False
+  except FileNotFoundError:
+    return False
+  if VERIFY_CACHED_COVERS and not (COVER_DIR / cache.cover_filename).exists():
+    return False
+  parent = str(PurePosixPath(path).parent)
+  if parent not in dir_is_current:
+    dir_is_current[parent] = folder_cover_is_current(local_path.parent, folder_cover)
+  return dir_is_current[parent]
+
+
+def _complete_metadata(path: str, cache: CachedAudioMetadata, folder_cover: db.FolderCover | None):
+  return AudioMetadata(
+    path=path,
+    mtime=cache.mtime,
+    file_mtime_ns=cache.file_mtime_ns,
+    file_size=cache.file_size,
+    file_inode=cache.file_inode,
+    cover_filename=cache.cover_filename,
+    cover_width=cache.cover_width,
+    cover_height=cache.cover_height,
+    cover_size=cache.cover_size,
+    tags=cache.tags,
+    is_complete=True,
+    folder_cover=folder_cover,
+  )
+
+
+def get_cached_audio_metadata(rel_paths: list[PurePosixPath]) -> dict[str, AudioMetadata]:
+  # complete metadata for the paths whose cache entry is still valid, with one
+  # query for all of them and no pool jobs. blocking, run it in a thread
+  cached = db.get_audio_metadata_by_paths([str(p) for p in rel_paths])
+  folder_covers = db.get_folder_covers(list({str(PurePosixPath(path).parent) for path in cached}))
+  dir_is_current: dict[str, bool] = {}
+  results: dict[str, AudioMetadata] = {}
+  for path, cache in cached.items():
+    folder_cover = folder_covers.get(str(PurePosixPath(path).parent))
+    if not _cache_entry_is_current(path, cache, folder_cover, dir_is_current):
+      continue
+    results[path] = _complete_metadata(path, cache, folder_cover)
+    metrics.metadata_cache_requests.inc('hit')
+  return results
+
+
+def _load_cached_entry(path: str) -> CachedEntry | None:
+  # blocking, run it in a thread
+  cache = db.get_audio_metadata_by_path(PurePosixPath(path))
+  if not cache:
+    return None
+  folder_cover = db.get_folder_cover(str(PurePosixPath(path).parent))
+  if not _cache_entry_is_current(path, cache, folder_cover, {}):
+    return None
+  return CachedEntry(metadata=_complete_metadata(path, cache, folder_cover), folder_cover=folder_cover)
+
+
+async def _get_cached_metadata(path: str) -> AudioMetadata | None:
+  # complete and current metadata without a pool job, from memory (a few stat
+  # calls on the event loop) or from the db in a thread
+  if METADATA_CACHE_SIZE <= 0:
+    return None
+  if entry := cached_entries.get(path):
+    if _cache_entry_is_current(path, entry.metadata, entry.folder_cover, {}):
+      cached_entries.move_to_end(path)
+      metrics.metadata_fast_path_requests.inc('memory')
+      metrics.metadata_cache_requests.inc('hit')
+      return entry.metadata
+    cached_entries.pop(path, None)
+  if not (entry := await asyncio.to_thread(_load_cached_entry, path)):
+    return None
+  _remember_entry(path, entry)
+  metrics.metadata_fast_path_requests.inc('db')
+  metrics.metadata_cache_requests.inc('hit')
+  return entry.metadata
+
+
+def _remember_entry(path: str, entry: CachedEntry):
+  if METADATA_CACHE_SIZE <= 0:
+    return
+  cached_entries[path] = entry
+  cached_entries.move_to_end(path)
+  while len(cached_entries) > METADATA_CACHE_SIZE:
+    cached_entries.popitem(last=False)
 
 
 def init():
-  global DEFAULT_COVER, process_pool, manager, busy_files
+  global DEFAULT_COVER, process_pool, result_queue
   COVER_DIR.mkdir(exist_ok=True, parents=True)
-  DEFAULT_COVER = resize_and_store_image(Image.open(DEFAULT_COVER_PATH))
-
-  process_pool = concurrent.futures.ProcessPoolExecutor(max_workers=METADATA_WORKERS, initializer=_mp_init, initargs=())
+  cover_store.migrate_flat_covers()
+  DEFAULT_COVER = store_image_file(DEFAULT_COVER_PATH)
 
-  MpManager.register('ResultWrapper', ResultWrapper)
-  MpManager.register('set', set)
-  manager = MpManager()
-  manager.start()
-  busy_files = manager.set()
+  result_queue = multiprocessing.SimpleQueue()
+  threading.Thread(target=_read_partial_results, name='partial-results', daemon=True).start()
+  process_pool = concurrent.futures.ProcessPoolExecutor(max_workers=METADATA_WORKERS, initializer=_mp_init, initargs=(result_queue,))
 
 
 DEFAULT_COVER: Cover = Cover(filename='', width=0, height=0)
+RESIZE_FILTER = (
+  Image.Resampling[COVER_FAST_RESAMPLE.upper()] if COVER_RESIZE_MODE == 'fast' else Image.Resampling.LANCZOS
+)
 
 process_pool = None
-manager: MpManager = None
+# workers send partial results through this, see _publish_partial_result
+result_queue: multiprocessing.queues.SimpleQueue = None
+# metadata jobs currently running in the pool, keyed by relative path
+in_flight_jobs: dict[str, MetadataJob] = {}
+jobs_by_id: dict[int, MetadataJob] = {}
+# number of requests that joined an already running job
+coalesced_requests = 0
+# complete metadata served without the pool, least recently used first
+cached_entries: OrderedDict[str, CachedEntry] = OrderedDict()
+# moving average of how long jobs take once a worker picks them up
+average_job_seconds = 0.0
+
+metrics.Gauge('metadata_cache_entries', 'Complete metadata kept in memory.', lambda: len(cached_entries))
+metrics.Gauge('metadata_jobs_in_flight', 'Metadata jobs submitted to the process pool and not finished.', lambda: len(jobs_by_id))
+metrics.Gauge('metadata_pool_queue_depth', 'Metadata jobs waiting for a free pool worker.', lambda: len(_queued_jobs()))
+metrics.Gauge(
+  'metadata_pool_oldest_queued_seconds', 'Time the oldest job waiting for a free pool worker has been queued.',
+  _oldest_queued_job_age
+)
+metrics.Gauge(
+  'metadata_job_average_seconds', 'Moving average of metadata job durations, used to decide when to shed load.',
+  lambda: average_job_seconds
+)
+metrics.Gauge(
+  'metadata_coalesced_requests_total', 'Requests that joined an already running metadata job.',
+  lambda: coalesced_requests, type='counter'
+)
@@ -4,10 +4,15 @@ import mutagen.mp3
 import mutagen.id3
 import mutagen.easyid3
 
+import struct
 from dataclasses import dataclass
 from pathlib import Path
 
 
+FLAC_VORBIS_COMMENT = 4
+FLAC_PICTURE = 6
+
+
 @dataclass(kw_only=True)
 class Tags:
   artist: str = ''
@@ -16,32 +21,111 @@ class Tags:
   date: str = ''
 
 
-def read_audio_tags(f: Path):
+def _read_flac_blocks(f: Path, read_picture: bool):
+  # walks the metadata blocks at the start of the file, seeking past
+  # everything we don't need (pictures too, unless asked for)
+  comment, picture = None, None
+  with open(f, 'rb') as fp:
+    if fp.read(4) != b'fLaC':
+      raise ValueError('no FLAC header')
+    is_last = False
+    while not is_last:
+      header = fp.read(4)
+      if len(header) < 4:
+        raise ValueError('truncated FLAC metadata')
+      block_type, size = header[0] & 0x7f, int.from_bytes(header[1:], 'big')
+      is_last = bool(header[0] & 0x80)
+      if block_type == FLAC_VORBIS_COMMENT and comment is None:
+        comment = mutagen.flac.VCFLACDict(fp.read(size))
+      elif block_type == FLAC_PICTURE and read_picture and picture is None:
+        picture = mutagen.flac.Picture(fp.read(size)).data
+      else:
+        fp.seek(size, 1)
+      if comment is not None and (picture is not None or not read_picture):
+        break
+  return comment, picture
+
+
+def _id3_text(id3: mutagen.id3.ID3, frame_id: str) -> list[str]:
+  frame = id3.get(frame_id)
+  return [str(text) for text in frame.text] if frame else []
+
+
+def _tags_from_flac(tags: Tags, comment: mutagen.flac.VCFLACDict):
   concat = lambda l: ', '.join(l)
-  m = mutagen.File(f, easy=True)
+  tags.artist = concat(comment.get('ARTIST', []))
+  tags.title = concat(comment.get('TITLE', []))
+  tags.date = concat(
+    comment.get('originalyear')
+    or comment.get('year')
+    or comment.get('originaldate')
+    or comment.get('releasedate')
+    or comment.get('date')
+    or []
+  )
+  tags.album = concat(comment.get('album', []))
 
-  tags: Tags = Tags()
-  if isinstance(m.tags, mutagen.flac.VCFLACDict):
-    tags.artist = concat(m.tags.get('ARTIST', []))
-    tags.title = concat(m.tags.get('TITLE', []))
-    tags.date = concat(
-      m.tags.get('originalyear')
-      or m.tags.get('year')
-      or m.tags.get('originaldate')
-      or m.tags.get('releasedate')
-      or m.tags.get('date')
-      or []
-    )
-    tags.album = concat(m.tags.get('album', []))
-  elif isinstance(m.tags, mutagen.easyid3.EasyID3):
-    tags.artist = concat(m.tags.get('artist', []))
-    tags.title = concat(m.tags.get('title', []))
-    tags.date = concat(
-      m.tags.get('date', [])
-      or m.tags.get('originaldate', [])
-    )
-    tags.album = concat(m.tags.get('album', []))
 
+def _tags_from_id3(tags: Tags, id3: mutagen.id3.ID3):
+  # same frames EasyID3 maps artist/title/date/originaldate/album to
+  concat = lambda l: ', '.join(l)
+  tags.artist = concat(_id3_text(id3, 'TPE1'))
+  tags.title = concat(_id3_text(id3, 'TIT2'))
+  tags.date = concat(
+    _id3_text(id3, 'TDRC')
+    or _id3_text(id3, 'TDOR')
+  )
+  tags.album = concat(_id3_text(id3, 'TALB'))
+
+
+def _read_any(f: Path, tags: Tags, read_picture: bool) -> bytes | None:
+  # fallback for anything the fast paths can't parse (e.g. FLAC with an ID3 header)
+  m = mutagen.File(f)
+  picture = None
+  if isinstance(m, mutagen.flac.FLAC):
+    if m.tags is not None:
+      _tags_from_flac(tags, m.tags)
+    if read_picture and m.pictures:
+      picture = m.pictures[0].data
+  elif isinstance(m, mutagen.mp3.MP3):
+    if m.tags is not None:
+      _tags_from_id3(tags, m.tags)
+    if read_picture and (pics := m.tags.getall('APIC') if m.tags else []):
+      picture = pics[0].data
+  else:
+    raise NotImplementedError
+  return picture
+
+
+def read_audio_file(f: Path, read_picture=True) -> tuple[Tags, bytes | None]:
+  # reads the tags and first embedded picture in a single pass over the
+  # metadata at the start of the file, never touching the audio data
+  tags: Tags = Tags()
+  picture = None
+  suffix = f.suffix.lower()
+  try:
+    if suffix == '.flac':
+      comment, picture = _read_flac_blocks(f, read_picture)
+      if comment is not None:
+        _tags_from_flac(tags, comment)
+    elif suffix == '.mp3':
+      try:
+        id3 = mutagen.id3.ID3(f)
+        _tags_from_id3(tags, id3)
+        if read_picture and (pics := id3.getall('APIC')):
+          picture = pics[0].data
+      except mutagen.id3.ID3NoHeaderError:
+        pass
+    else:
+      picture = _read_any(f, tags, read_picture)
+  except (ValueError, struct.error, mutagen.MutagenError):
+    tags = Tags()
+    picture = _read_any(f, tags, read_picture)
 
   tags.title = tags.title or f.stem
-  return tags
\ No newline at end of file
+  return tags, picture
+
+
+def read_audio_tags(f: Path):
+  tags, _ = read_audio_file(f, read_picture=False)
+  return tags
@@ -0,0 +1,279 @@
+import bisect
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any
+
+
+# seconds, spanning a cached lookup up to a large cover being resized
+DEFAULT_BUCKETS = (
+  0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+)
+SCAN_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 120, 300)
+
+# metrics are updated from worker threads (the db flusher, the indexer,
+# asyncio.to_thread calls) while the event loop renders them
+_lock = threading.Lock()
+
+
+def _reset_lock_after_fork():
+  # pool workers may be forked while another thread holds it
+  global _lock
+  _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_lock_after_fork)
+
+
+def _format_labels(labels: dict[str, str]) -> str:
+  if not labels:
+    return ''
+  escape = lambda v: str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+  return '{' + ','.join(f'{k}="{escape(v)}"' for k, v in labels.items()) + '}'
+
+
+class Metric(ABC):
+  type = ''
+
+  def __init__(self, name: str, help: str, label: str | None = None, per_process=False):
+    self.name = name
+    self.help = help
+    # optional label name, each value of it gets its own series
+    self.label = label
+    # kept by each http worker process, the hub adds up the values they report
+    self.per_process = per_process
+    registry.append(self)
+
+  def _labels(self, label_value: str | None) -> dict[str, str]:
+    return {self.label: label_value} if self.label else {}
+
+  @abstractmethod
+  def state(self) -> dict[str | None, Any]:
+    # the values reported to the hub by http workers for per_process metrics
+    ...
+
+  @abstractmethod
+  def samples(self, remote_states: list[dict[str | None, Any]]) -> list[str]:
+    # exposition lines, remote_states are the states of the other processes
+    ...
+
+  def render(self) -> str:
+    remote = [states[self.name] for states in remote_states.values() if self.name in states] if self.per_process else []
+    lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+    return '\n'.join(lines + self.samples(remote))
+
+
+class Counter(Metric):
+  type = 'counter'
+
+  def __init__(self, name: str, help: str, label: str | None = None, per_process=False):
+    super().__init__(name, help, label, per_process)
+    self.values: dict[str | None, float] = {} if label else {None: 0}
+
+  def inc(self, label_value: str | None = None, amount: float = 1):
+    with _lock:
+      self.values[label_value] = self.values.get(label_value, 0) + amount
+
+  def state(self):
+    with _lock:
+      return dict(self.values)
+
+  def samples(self, remote_states):
+    values = self.state()
+    for state in remote_states:
+      for label_value, value in state.items():
+        values[label_value] = values.get(label_value, 0) + value
+    return [
+      f'{self.name}{_format_labels(self._labels(label_value))} {value}'
+      for label_value, value in values.items()
+    ]
+
+
+class Gauge(Metric):
+  type = 'gauge'
+
+  def __init__(self, name: str, help: str, fn, type='gauge', per_process=False, combine=sum):
+    # read when rendering, so nothing needs updating on the hot path. type can
+    # be set to 'counter' for values that are already counted elsewhere.
+    # combine turns the values of all processes into one for per_process gauges
+    super().__init__(name, help, per_process=per_process)
+    self.fn = fn
+    self.type = type
+    self.combine = combine
+
+  def state(self):
+    return {None: self.fn()}
+
+  def samples(self, remote_states):
+    values = [self.fn(), *(state[None] for state in remote_states if None in state)]
+    return [f'{self.name} {self.combine(values)}']
+
+
+@dataclass(kw_only=True)
+class HistogramSeries:
+  # per bucket (not cumulative) counts, the last one is +Inf
+  counts: list[int]
+  sum: float = 0
+  count: int = 0
+
+
+class Histogram(Metric):
+  type = 'histogram'
+
+  def __init__(self, name: str, help: str, label: str | None = None, buckets=DEFAULT_BUCKETS, per_process=False):
+    super().__init__(name, help, label, per_process)
+    self.buckets = tuple(buckets)
+    self.series: dict[str | None, HistogramSeries] = {}
+
+  def observe(self, value: float, label_value: str | None = None):
+    with _lock:
+      series = self.series.get(label_value)
+      if series is None:
+        series = self.series[label_value] = HistogramSeries(counts=[0] * (len(self.buckets) + 1))
+      series.counts[bisect.bisect_left(self.buckets, value)] += 1
+      series.sum += value
+      series.count += 1
+
+  def state(self):
+    with _lock:
+      return {
+        label_value: HistogramSeries(counts=list(series.counts), sum=series.sum, count=series.count)
+        for label_value, series in self.series.items()
+      }
+
+  def samples(self, remote_states):
+    merged = self.state()
+    for state in remote_states:
+      for label_value, remote in state.items():
+        series = merged.setdefault(label_value, HistogramSeries(counts=[0] * (len(self.buckets) + 1)))
+        series.counts = [a + b for a, b in zip(series.counts, remote.counts)]
+        series.sum += remote.sum
+        series.count += remote.count
+    lines = []
+    for label_value, series in merged.items():
+      labels = self._labels(label_value)
+      cumulative = 0
+      for bound, count in zip((*self.buckets, '+Inf'), series.counts):
+        cumulative += count
+        lines.append(f'{self.name}_bucket{_format_labels({**labels, 'le': bound})} {cumulative}')
+      lines.append(f'{self.name}_sum{_format_labels(labels)} {series.sum}')
+      lines.append(f'{self.name}_count{_format_labels(labels)} {series.count}')
+    return lines
+
+
+def render() -> str:
+  return '\n'.join(metric.render() for metric in registry) + '\n'
+
+
+def collect_local() -> dict[str, dict[str | None, Any]]:
+  # values of the per process metrics, sent by http workers to the hub
+  return {metric.name: metric.state() for metric in registry if metric.per_process}
+
+
+@dataclass(kw_only=True)
+class JobStats:
+  # collected by a pool worker while it runs a metadata job and sent back with
+  # the result, the main process turns them into histogram observations
+  stages: dict[str, float] = field(default_factory=dict)
+  # 'hit', 'stale' or 'miss' for the cached metadata of the file
+  cache_result: str = 'miss'
+  # durations of db write batches flushed in the worker since its last job
+  db_flushes: list[float] = field(default_factory=list)
+  # perf_counter() in the worker when the job started, and how long it ran.
+  # measured there as the job's start message may be read after its result
+  started_at: float = field(default_factory=time.perf_counter)
+  seconds: float = 0
+
+
+@contextmanager
+def stage(name: str):
+  start = time.perf_counter()
+  try:
+    yield
+  finally:
+    job_stats.stages[name] = job_stats.stages.get(name, 0) + time.perf_counter() - start
+
+
+def start_job():
+  global job_stats
+  job_stats = JobStats()
+
+
+def finish_job() -> JobStats:
+  global _db_flushes
+  stats = job_stats
+  stats.seconds = time.perf_counter() - stats.started_at
+  with _lock:
+    stats.db_flushes, _db_flushes = _db_flushes, []
+  start_job()
+  return stats
+
+
+def record_db_flush(duration: float):
+  # called from the db flush thread, picked up by the next job in workers
+  with _lock:
+    _db_flushes.append(duration)
+    del _db_flushes[:-100]
+
+
+def observe_job(stats: JobStats):
+  for name, duration in stats.stages.items():
+    metadata_stage_seconds.observe(duration, name)
+  metadata_cache_requests.inc(stats.cache_result)
+  for duration in stats.db_flushes:
+    db_flush_seconds.observe(duration)
+
+
+def observe_local_db_flushes():
+  global _db_flushes
+  with _lock:
+    flushes, _db_flushes = _db_flushes, []
+  for duration in flushes:
+    db_flush_seconds.observe(duration)
+
+
+registry: list[Metric] = []
+# per process metric values last reported by each http worker
+remote_states: dict[str, dict[str, dict[str | None, Any]]] = {}
+# stats of the job the current (worker) process is running
+job_stats = JobStats()
+_db_flushes: list[float] = []
+
+metadata_stage_seconds = Histogram(
+  'metadata_stage_seconds', 'Time spent in each stage of reading a file\'s metadata.', label='stage'
+)
+metadata_cache_requests = Counter(
+  'metadata_cache_requests_total', 'Metadata lookups by the state of the cached metadata.', label='result'
+)
+metadata_fast_path_requests = Counter(
+  'metadata_fast_path_requests_total', 'Metadata requests answered without a pool job, by where it came from.',
+  label='source'
+)
+metadata_timeouts = Counter(
+  'metadata_timeouts_total', 'Requests that were answered with partial metadata after the timeout.'
+)
+metadata_rejections = Counter(
+  'metadata_rejections_total', 'Requests answered with a placeholder because the metadata queue was too long.'
+)
+covers_removed = Counter(
+  'covers_removed_total', 'Stored covers removed because no audio file used them.'
+)
+revalidated_rows = Counter(
+  'revalidated_rows_total', 'Metadata cache rows found by revalidation sweeps to be out of date.', label='result'
+)
+suppressed_path_checks = Counter(
+  'suppressed_path_checks_total', 'Requests for unindexed paths that were rejected without checking the disk.',
+  label='reason'
+)
+embed_cache_requests = Counter(
+  'embed_cache_requests_total', 'Rendered embed page cache lookups.', label='result', per_process=True
+)
+db_flush_seconds = Histogram(
+  'db_flush_seconds', 'Time spent writing a batch of queued rows to the cache db.'
+)
+index_scan_seconds = Histogram(
+  'index_scan_seconds', 'Duration of file index scans.', label='kind', buckets=SCAN_BUCKETS
+)
@@ -0,0 +1,111 @@
+from collections.abc import Iterable, Iterator
+
+
+# directories with more files than this keep their names in a frozenset,
+# smaller ones in a single string that is searched
+PACKED_DIR_MAX_FILES = 256
+
+
+def _dir_key(relative_dir: str) -> str:
+  return '' if relative_dir == '.' else relative_dir
+
+
+class PathIndex:
+  # set of relative file paths that stores each directory once. the names of
+  # the files in a directory are packed into one '\0name\0name\0' string, so a
+  # path costs little more than the length of its name instead of a whole
+  # string object with its directory repeated
+
+  def __init__(self):
+    # relative directory ('' for the top level) -> names of its files
+    self._dirs: dict[str, str | frozenset[str]] = {}
+    self._count = 0
+
+  @classmethod
+  def from_paths(cls, paths: Iterable[str]):
+    # packs each run of paths in the same directory as it goes, so only one
+    # directory's names are ever held as separate strings
+    index = cls()
+    current_dir, names = None, set()
+    for path in paths:
+      relative_dir, _, name = path.rpartition('/')
+      if relative_dir != current_dir:
+        if names:
+          index.set_dir(current_dir, index.names_in_dir(current_dir) | names)
+        current_dir, names = relative_dir, set()
+      names.add(name)
+    if names:
+      index.set_dir(current_dir, index.names_in_dir(current_dir) | names)
+    return index
+
+  @staticmethod
+  def _pack(names: set[str]) -> str | frozenset[str]:
+    if len(names) > PACKED_DIR_MAX_FILES:
+      return frozenset(names)
+    return '\0' + '\0'.join(sorted(names)) + '\0'
+
+  @staticmethod
+  def _unpack(names: str | frozenset[str]) -> set[str]:
+    if isinstance(names, str):
+      return set(names[1:-1].split('\0'))
+    return set(names)
+
+  @staticmethod
+  def _len(names: str | frozenset[str]) -> int:
+    return names.count('\0') - 1 if isinstance(names, str) else len(names)
+
+  def __contains__(self, path: str) -> bool:
+    relative_dir, _, name = path.rpartition('/')
+    names = self._dirs.get(relative_dir)
+    if names is None or not name:
+      return False
+    if type(names) is str:
+      return f'\0{name}\0' in names
+    return name in names
+
+  def __len__(self):
+    return self._count
+
+  def __iter__(self) -> Iterator[str]:
+    for relative_dir, names in list(self._dirs.items()):
+      prefix = f'{relative_dir}/' if relative_dir else ''
+      for name in self._unpack(names):
+        yield prefix + name
+
+  def iter_dirs(self) -> Iterator[tuple[str, str]]:
+    # each directory with the names of its files packed as '\0name\0name\0',
+    # without making a string per path
+    for relative_dir, names in list(self._dirs.items()):
+      yield relative_dir, names if isinstance(names, str) else '\0' + '\0'.join(names) + '\0'
+
+  def names_in_dir(self, relative_dir: str) -> set[str]:
+    names = self._dirs.get(_dir_key(relative_dir))
+    return self._unpack(names) if names is not None else set()
+
+  def set_dir(self, relative_dir: str, names: set[str]):
+    # replaces the files directly in a directory, subdirectories are untouched
+    relative_dir = _dir_key(relative_dir)
+    old = self._dirs.get(relative_dir)
+    self._count -= self._len(old) if old is not None else 0
+    if names:
+      self._dirs[relative_dir] = self._pack(names)
+      self._count += len(names)
+    else:
+      self._dirs.pop(relative_dir, None)
+
+  def remove_tree(self, relative_dir: str):
+    # removes the files in a directory and all of its subdirectories
+    relative_dir = _dir_key(relative_dir)
+    prefix = f'{relative_dir}/'
+    for d in [d for d in self._dirs if d == relative_dir or d.startswith(prefix) or not relative_dir]:
+      self.set_dir(d, set())
+
+  def add(self, path: str):
+    relative_dir, _, name = path.rpartition('/')
+    if path not in self:
+      self.set_dir(relative_dir, self.names_in_dir(relative_dir) | {name})
+
+  def discard(self, path: str):
+    relative_dir, _, name = path.rpartition('/')
+    if path in self:
+      self.set_dir(relative_dir, self.names_in_dir(relative_dir) - {name})
@@ -1,24 +1,51 @@
 import asyncio
 import datetime
+import json
 import logging
+import math
 logging.basicConfig(level=logging.INFO)
+import multiprocessing
+import multiprocessing.connection
+import signal
+import sys
+import time
 import uuid
+from functools import partial
 from pathlib import Path, PurePosixPath
 
 from aiohttp import web
 from aiohttp.typedefs import Handler
 from yarl import URL
 
+import cache_warmer
+import db
+import cover_store
+import embed_cache
 import file_indexer
+import hub
 import metadata_service
+import metrics
 import templates
 from config import (
-  COVER_DIR, COVER_HTTP_ROOT, HTTP_HOST, HTTP_ROOT, MUSIC_DIR, PORT, SERVE_FILES,
+  BATCH_API_PATH, BATCH_MAX_PATHS, BATCH_TIMEOUT, COVER_DIR, COVER_HTTP_ROOT, HTTP_HOST, HTTP_ROOT,
+  HTTP_WORKERS, HUB_SOCKET_PATH, INDEX_SNAPSHOT_PATH, METADATA_WORKERS, METRICS_PATH, MUSIC_DIR, PORT,
+  SEARCH_API_PATH, SEARCH_MAX_RESULTS, SERVE_FILES,
 )
-from metadata_service import get_audio_metadata
+from metadata_service import AudioMetadata
 
 
+# seconds between checks for a new index snapshot in http workers
+INDEX_RELOAD_INTERVAL = 5
+
 logger = logging.getLogger('main')
+started_at = time.monotonic()
+# seconds from startup until the first complete embed page was sent
+first_valid_response_after: float | None = None
+
+# file index and metadata, a HubClient in http worker processes
+backend: hub.LocalBackend | hub.HubClient = hub.LocalBackend()
+# name of this http worker process, None when running in a single process
+worker_name: str | None = None
 
 routes = web.RouteTableDef()
 
@@ -29,83 +56,270 @@ def serve_file(req: web.Request, local_path: Path):
   if local_path.is_file():
     return web.FileResponse(local_path)
   try:
-    cover_path = COVER_DIR / PurePosixPath(req.path).relative_to(COVER_HTTP_ROOT)
-    return web.FileResponse(cover_path)
+    cover_filename = PurePosixPath(req.path).relative_to(COVER_HTTP_ROOT)
   except ValueError:
-    pass
+    return
+  # urls from before covers were sharded (a web server in front of this needs
+  # the same rewrite: /cover/<abcd...>.jpg -> /cover/<ab>/<cd>/<abcd...>.jpg)
+  if sharded_filename := cover_store.get_sharded_filename(str(cover_filename)):
+    cover_filename = sharded_filename
+  return web.FileResponse(COVER_DIR / cover_filename)
 
 
-@routes.get('/{path:.*}')
-async def api_get_root(req: web.Request):
+def get_origin(req: web.Request):
   host = HTTP_HOST or req.headers.get('X-Forwarded-Host', '') or req.host
   scheme = req.headers.get('X-Forwarded-Proto', '') or req.scheme
+  return scheme, host
+
+
+def get_cover_url(scheme: str, host: str, cover_filename: str):
+  return str(URL.build(
+    scheme=scheme,
+    authority=host,
+    path=str(COVER_HTTP_ROOT / PurePosixPath(cover_filename))
+  ))
+
+
+@routes.get('/{path:.*}')
+async def api_get_root(req: web.Request):
+  scheme, host = get_origin(req)
 
   try:
     rel_path = PurePosixPath(req.path).relative_to(HTTP_ROOT)
   except ValueError:
-    return web.Response(body='400: Invalid path [%UUID%]', status=400)
+    return web.Response(text='400: Invalid path [%UUID%]', status=400)
 
   local_path = MUSIC_DIR / rel_path
 
   if SERVE_FILES and (res := serve_file(req, local_path)) is not None:
     return res
 
-  if not file_indexer.path_is_valid(rel_path):
-    asyncio.create_task(file_indexer.rescan_if_index_is_outdated(local_path))
-    return web.Response(body='400: Path is not a valid file [%UUID%]', status=400)
+  if not file_indexer.path_is_valid(rel_path) and not await backend.check_path(rel_path):
+    return web.Response(text='400: Path is not a valid file [%UUID%]', status=400)
 
   try:
-    metadata = await get_audio_metadata(rel_path, uuid=req.get('UUID', '-'), timeout=2)
+    stat = local_path.stat()
+    cache_key = embed_cache.make_key(rel_path, scheme, host, stat)
+    if embed := embed_cache.get(cache_key):
+      return embed_response(req, embed)
+    metadata = await backend.get_audio_metadata(rel_path, uuid=req.get('UUID', '-'), timeout=2)
   except FileNotFoundError:
     logger.exception(f'Error parsing request {req.get('UUID', '-')}')
-    return web.Response(body='404: Path was not found, check logs [%UUID%]', status=404)
+    return web.Response(text='404: Path was not found, check logs [%UUID%]', status=404)
   except:
     logger.exception(f'Error parsing request {req.get('UUID', '-')}')
-    return web.Response(body='500: Unexpected error occured, check logs [%UUID%]', status=500)
+    return web.Response(text='500: Unexpected error occured, check logs [%UUID%]', status=500)
 
   gmt_now = datetime.datetime.now(datetime.timezone.utc).strftime("%a, %d %b %Y %H:%M:%S GMT")
-  body = templates.get_html(
+  body = templates.render_html(
     meta=metadata,
     content_url=str(URL.build(scheme=scheme, authority=host, path=req.path)),
-    cover_url=str(URL.build(
-      scheme=scheme,
-      authority=host,
-      path=str(COVER_HTTP_ROOT / PurePosixPath(metadata.cover_filename))
-    )),
+    cover_url=get_cover_url(scheme, host, metadata.cover_filename),
     gmt_now=gmt_now
   )
 
-  return web.Response(
-    body=body,
-    content_type='text/html',
-    headers={
-      'Cache-Control': 'public' if metadata.is_complete else 'max-age=5',
-      'Last-Modified': gmt_now
+  if not metadata.is_complete:
+    # placeholders must not be revalidated against the real page later on
+    return web.Response(
+      body=body,
+      content_type='text/html',
+      charset='utf-8',
+      headers={'Cache-Control': 'max-age=5'}
+    )
+
+  embed = embed_cache.make_embed(cache_key, body, metadata)
+  embed_cache.put(cache_key, embed)
+  return embed_response(req, embed)
+
+
+def batch_entry(path: str, scheme: str, host: str, metadata: AudioMetadata | None = None, error=''):
+  entry = {'path': path}
+  if error:
+    entry['error'] = error
+  if metadata:
+    entry.update(
+      url=str(URL.build(scheme=scheme, authority=host, path=str(HTTP_ROOT / path))),
+      complete=metadata.is_complete,
+      artist=metadata.tags.artist,
+      title=metadata.tags.title,
+      album=metadata.tags.album,
+      date=metadata.tags.date,
+      cover_url=get_cover_url(scheme, host, metadata.cover_filename),
+      cover_width=metadata.cover_width,
+      cover_height=metadata.cover_height,
+    )
+  return json.dumps(entry, ensure_ascii=False).encode() + b'\n'
+
+
+async def api_post_batch(req: web.Request):
+  # takes a JSON list of paths relative to the music directory (or an object
+  # with "paths" and an optional "timeout"), and streams back one JSON object
+  # per line: cached entries first, then the rest as their metadata is read
+  scheme, host = get_origin(req)
+  req_uuid = req.get('UUID', '-')
+  try:
+    body = await req.json()
+    paths = body.get('paths') if isinstance(body, dict) else body
+    timeout = min(float(body.get('timeout', BATCH_TIMEOUT)), BATCH_TIMEOUT) if isinstance(body, dict) else BATCH_TIMEOUT
+    if not isinstance(paths, list) or not all(isinstance(p, str) for p in paths):
+      raise ValueError
+  except (ValueError, TypeError):
+    return web.Response(text='400: Expected a JSON list of paths [%UUID%]', status=400)
+  if len(paths) > BATCH_MAX_PATHS:
+    return web.Response(text=f'413: At most {BATCH_MAX_PATHS} paths can be requested at once [%UUID%]', status=413)
+
+  loop = asyncio.get_running_loop()
+  deadline = loop.time() + timeout
+  valid_paths: list[PurePosixPath] = []
+  invalid_paths: list[str] = []
+  for path in dict.fromkeys(p.lstrip('/') for p in paths):
+    rel_path = PurePosixPath(path)
+    # checked before the index or the disk is touched, unlike GET paths these aren't normalised
+    if not file_indexer.path_is_well_formed(path):
+      invalid_paths.append(path)
+    elif file_indexer.path_is_valid(rel_path) or await backend.check_path(rel_path):
+      valid_paths.append(rel_path)
+    else:
+      invalid_paths.append(path)
+
+  resp = web.StreamResponse(headers={'X-UUID': req_uuid})
+  resp.content_type = 'application/x-ndjson'
+  resp.charset = 'utf-8'
+  await resp.prepare(req)
+  await resp.write(b''.join(batch_entry(p, scheme, host, error='not a valid file') for p in invalid_paths))
+
+  cached = await asyncio.to_thread(metadata_service.get_cached_audio_metadata, valid_paths)
+  await resp.write(b''.join(batch_entry(path, scheme, host, metadata) for path, metadata in cached.items()))
+
+  # at most one job per worker at a time, so a batch can't queue up the whole
+  # pool in front of normal requests
+  semaphore = asyncio.Semaphore(METADATA_WORKERS)
+  async def fetch(rel_path: PurePosixPath):
+    async with semaphore:
+      try:
+        return rel_path, await backend.get_audio_metadata(rel_path, req_uuid, max(0, deadline - loop.time()))
+      except Exception:
+        logger.exception(f'[{req_uuid}] error fetching metadata for {rel_path}')
+        return rel_path, None
+
+  tasks = [asyncio.create_task(fetch(p)) for p in valid_paths if str(p) not in cached]
+  try:
+    for task in asyncio.as_completed(tasks):
+      rel_path, metadata = await task
+      if metadata:
+        await resp.write(batch_entry(str(rel_path), scheme, host, metadata))
+      else:
+        await resp.write(batch_entry(str(rel_path), scheme, host, error='unexpected error, check logs'))
+  finally:
+    # only does something if the client went away, jobs already in the pool still finish
+    for task in tasks:
+      task.cancel()
+  await resp.write_eof()
+  return resp
+
+
+async def api_get_search(req: web.Request):
+  # ?q=words&limit=N, every word matches the start of a word in the artist,
+  # title or album. answers with a JSON list of the best matches first
+  scheme, host = get_origin(req)
+  try:
+    limit = max(1, min(int(req.query.get('limit', SEARCH_MAX_RESULTS)), SEARCH_MAX_RESULTS))
+  except ValueError:
+    return web.Response(text='400: limit must be a number [%UUID%]', status=400)
+  matches = await asyncio.to_thread(db.search_audio_metadata, req.query.get('q', ''), limit)
+  results = [
+    {
+      'path': meta.path,
+      'url': str(URL.build(scheme=scheme, authority=host, path=str(HTTP_ROOT / meta.path))),
+      'artist': meta.tags.artist,
+      'title': meta.tags.title,
+      'album': meta.tags.album,
+      'date': meta.tags.date,
     }
+    # rows of files that were deleted stay in the db
+    for meta in matches if file_indexer.path_is_valid(PurePosixPath(meta.path))
+  ]
+  return web.json_response(results, dumps=partial(json.dumps, ensure_ascii=False))
+
+
+async def api_get_metrics(req: web.Request):
+  text = await backend.render_metrics(worker_name, metrics.collect_local() if worker_name else None)
+  return web.Response(
+    body=text.encode(),
+    headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
   )
 
 
+def embed_response(req: web.Request, embed: embed_cache.CachedEmbed):
+  if embed_cache.is_not_modified(req, embed):
+    resp = web.Response(status=304, headers={'Cache-Control': 'public'})
+  else:
+    resp = web.Response(body=embed.body, content_type='text/html', charset='utf-8', headers={'Cache-Control': 'public'})
+    if first_valid_response_after is None:
+      log_first_valid_response()
+  resp.etag = embed.etag
+  resp.last_modified = embed.last_modified
+  return resp
+
+
 @web.middleware
 async def uuid_middleware(request: web.Request, handler: Handler):
   req_uuid = str(uuid.uuid4())
   request['UUID'] = req_uuid
   resp = await handler(request)
   resp.headers['X-UUID'] = req_uuid
-  if isinstance(resp, web.Response):
-    resp.text = (resp.text or '').replace('%UUID%', req_uuid)
+  # checked on the bytes, so pages without a placeholder are never decoded
+  if isinstance(resp, web.Response) and isinstance(resp.body, bytes) and b'%UUID%' in resp.body:
+    resp.body = resp.body.replace(b'%UUID%', req_uuid.encode())
   return resp
 
 
-async def main():
+def log_first_valid_response():
+  global first_valid_response_after
+  first_valid_response_after = time.monotonic() - started_at
+  logger.info(f'first embed page sent {first_valid_response_after:.3f}s after startup')
+
+
+def _first_valid_response_after():
+  return first_valid_response_after if first_valid_response_after is not None else math.nan
+
+
+def _earliest(values: list[float]):
+  # the hub never serves pages itself, http workers that haven't yet report NaN
+  return min((v for v in values if not math.isnan(v)), default=math.nan)
+
+
+metrics.Gauge(
+  'startup_first_embed_page_seconds', 'Time from startup until the first complete embed page was sent, NaN until then.',
+  _first_valid_response_after, per_process=True, combine=_earliest
+)
+
+
+def create_app():
   app = web.Application(middlewares=[uuid_middleware])
+  if METRICS_PATH:
+    # before the catch-all route
+    app.router.add_get(METRICS_PATH, api_get_metrics)
+  if BATCH_API_PATH:
+    app.router.add_post(BATCH_API_PATH, api_post_batch)
+  if SEARCH_API_PATH:
+    app.router.add_get(SEARCH_API_PATH, api_get_search)
   app.add_routes(routes)
+  return app
 
-  runner = web.AppRunner(
+
+def create_runner(app: web.Application):
+  return web.AppRunner(
     app,
     access_log_format='%a (%{X-Forwarded-For}i) %t (%Tfs) [%{X-UUID}o] "%r" %s %b "%{Referer}i" "%{User-Agent}i"',
     handle_signals=True
   )
+
+
+async def main():
+  runner = create_runner(create_app())
   await runner.setup()
+  file_indexer.load_snapshot()
   site = web.TCPSite(
     runner,
     host='localhost',
@@ -116,15 +330,107 @@ async def main():
   if not await file_indexer.scan_music_dir():
     logger.error('Scanning music directory failed, exiting')
     exit(1)
+  await file_indexer.start_watching()
+  cache_warmer.start()
+  cache_warmer.start_revalidation()
+  cover_store.start(keep={metadata_service.DEFAULT_COVER.filename})
 
   while True:
-    await asyncio.sleep(3600)
+    await asyncio.sleep(60)
+    await file_indexer.save_snapshot()
 
 
-if __name__ == '__main__':
-  metadata_service.init()
+async def _reload_index_snapshot():
+  # http workers only read the index, from the snapshots the hub saves
+  loaded_mtime = None
+  while True:
+    try:
+      mtime = INDEX_SNAPSHOT_PATH.stat().st_mtime_ns
+    except FileNotFoundError:
+      mtime = None
+    if mtime != loaded_mtime:
+      loaded_mtime = mtime
+      await asyncio.to_thread(file_indexer.load_snapshot)
+    await asyncio.sleep(INDEX_RELOAD_INTERVAL)
+
 
+async def _report_metrics():
+  while True:
+    await asyncio.sleep(10)
+    await backend.render_metrics(worker_name, metrics.collect_local())
+
+
+async def http_worker_main():
+  global backend
+  backend = await hub.HubClient.connect(HUB_SOCKET_PATH)
+  runner = create_runner(create_app())
+  await runner.setup()
+  site = web.TCPSite(
+    runner,
+    host='localhost',
+    port=PORT,
+    # every worker listens on the same port, the kernel spreads connections
+    reuse_port=True
+  )
+  await site.start()
+  reload_task = asyncio.create_task(_reload_index_snapshot())
+  report_task = asyncio.create_task(_report_metrics())
+  await backend.closed.wait()
+  logger.error('hub went away, exiting')
+  exit(1)
+
+
+def run_http_worker(name: str):
+  global worker_name
+  worker_name = name
+  asyncio.run(http_worker_main())
+
+
+async def hub_main(workers: list[multiprocessing.Process]):
+  file_indexer.load_snapshot()
+  await hub.serve(HUB_SOCKET_PATH, backend)
+  logger.info(f'serving the index and metadata pool to {len(workers)} http workers...')
+  if not await file_indexer.scan_music_dir():
+    logger.error('Scanning music directory failed, exiting')
+    exit(1)
+  await file_indexer.start_watching()
+  cache_warmer.start()
+  cache_warmer.start_revalidation()
+  cover_store.start(keep={metadata_service.DEFAULT_COVER.filename})
+
+  workers_exited = asyncio.create_task(asyncio.to_thread(
+    multiprocessing.connection.wait, [worker.sentinel for worker in workers]
+  ))
+  while not workers_exited.done():
+    await asyncio.wait([workers_exited], timeout=60)
+    await file_indexer.save_snapshot()
+  logger.error('an http worker exited, shutting down')
+  exit(1)
+
+
+def start_http_workers():
+  # forked before the metadata pool and any threads are started
+  workers = [
+    multiprocessing.get_context('fork').Process(
+      target=run_http_worker, args=(f'http-{i}',), name=f'http-{i}', daemon=True
+    )
+    for i in range(HTTP_WORKERS)
+  ]
+  for worker in workers:
+    worker.start()
+  return workers
+
+
+if __name__ == '__main__':
   # cache node id
   uuid.getnode()
 
-  asyncio.run(main())
\ No newline at end of file
+  if HTTP_WORKERS > 1:
+    workers = start_http_workers()
+    metadata_service.init()
+    # exit normally so the http workers are terminated
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    asyncio.run(hub_main(workers))
+  else:
+    metadata_service.init()
+    asyncio.run(main())
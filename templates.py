@@ -1,5 +1,6 @@
 import string
 import html
+from dataclasses import dataclass
 from typing import override
 from config import PAGE_TITLE, SITE_NAME, THEME_COLOR
 from metadata_service import AudioMetadata
@@ -56,31 +57,7 @@ def multi_line_trim(lines: list[str], max_chars: int, line_sep_len: int=1) -> li
   return lines
 
 
-def get_html(
-  meta: AudioMetadata,
-  content_url: str,
-  cover_url: str,
-  gmt_now: str
-):
-  tags = meta.tags
-  song_info = f'{tags.title} by {tags.artist}' if tags.artist else tags.title
-  album, date = get_album_info(tags)
-  site_name_lines = [SITE_NAME]
-  cover_width = meta.cover_width
-  cover_height = meta.cover_height
-
-  if album:
-    site_name_lines.extend(['', album, date])
-  if tags.artist:
-    site_name_lines.extend(['', tags.artist])
-  site_name = '\n'.join(
-    multi_line_trim(site_name_lines, 256)
-  )
-  # put date on same line as album, after trimming
-  if date:
-    site_name = r_replace(site_name, f'\n{date}', f' {date}', 1)
-
-  return FORMATTER.format('''
+TEMPLATE = '''
 <!DOCTYPE html>
 <html lang="en">
 <head>
@@ -132,20 +109,107 @@ def get_html(
   <p>Generated at: {gmt_now}</p>
 </body>
 </html>
-''',
-  THEME_COLOR=THEME_COLOR,
-  PAGE_TITLE=PAGE_TITLE,
-  site_name=site_name,
-  song_info=song_info,
-  cover_url=cover_url,
-  content_url=content_url,
-  cover_width=cover_width,
-  cover_height=cover_height,
-  title=tags.title,
-  artist=tags.artist,
-  album_info=f'{album} {date}' if album else '',
-  gmt_now=gmt_now,
-)
-
-
-FORMATTER = HTMLFormatter()
\ No newline at end of file
+'''
+
+
+def _template_fields(
+  meta: AudioMetadata,
+  content_url: str,
+  cover_url: str,
+  gmt_now: str
+):
+  tags = meta.tags
+  song_info = f'{tags.title} by {tags.artist}' if tags.artist else tags.title
+  album, date = get_album_info(tags)
+  site_name_lines = [SITE_NAME]
+
+  if album:
+    site_name_lines.extend(['', album, date])
+  if tags.artist:
+    site_name_lines.extend(['', tags.artist])
+  site_name = '\n'.join(
+    multi_line_trim(site_name_lines, 256)
+  )
+  # put date on same line as album, after trimming
+  if date:
+    site_name = r_replace(site_name, f'\n{date}', f' {date}', 1)
+
+  return dict(
+    site_name=site_name,
+    song_info=song_info,
+    cover_url=cover_url,
+    content_url=content_url,
+    cover_width=meta.cover_width,
+    cover_height=meta.cover_height,
+    title=tags.title,
+    artist=tags.artist,
+    album_info=f'{album} {date}' if album else '',
+    gmt_now=gmt_now,
+  )
+
+
+def get_html(
+  meta: AudioMetadata,
+  content_url: str,
+  cover_url: str,
+  gmt_now: str
+):
+  # reference renderer, parses the template on every call
+  return FORMATTER.format(
+    TEMPLATE,
+    THEME_COLOR=THEME_COLOR,
+    PAGE_TITLE=PAGE_TITLE,
+    **_template_fields(meta, content_url, cover_url, gmt_now)
+  )
+
+
+@dataclass(kw_only=True)
+class CompiledTemplate:
+  # literal text (with constants already substituted) alternating with
+  # (field name, is_attr) pairs, starting and ending with literal text
+  literals: list[str]
+  fields: list[tuple[str, bool]]
+
+  def render(self, values: dict) -> bytes:
+    # fields like content_url appear several times, escape each one once
+    escaped: dict[tuple[str, bool], str] = {}
+    parts = [self.literals[0]]
+    for field, literal in zip(self.fields, self.literals[1:]):
+      if (value := escaped.get(field)) is None:
+        name, is_attr = field
+        value = escaped[field] = html.escape(format(values[name], ''), quote=is_attr)
+      parts.append(value)
+      parts.append(literal)
+    return ''.join(parts).encode()
+
+
+def compile_template(template: str, constants: dict) -> CompiledTemplate:
+  # parses the template once and escapes the constants into the literal text,
+  # gives the same output as HTMLFormatter for the fields it supports
+  compiled = CompiledTemplate(literals=[''], fields=[])
+  for literal, name, format_spec, conversion in FORMATTER.parse(template):
+    compiled.literals[-1] += literal
+    if name is None:
+      continue
+    if conversion or format_spec not in ('', 'attr'):
+      raise ValueError(f'unsupported template field {{{name}!{conversion}:{format_spec}}}')
+    if name in constants:
+      compiled.literals[-1] += FORMATTER.format_field(constants[name], format_spec)
+    else:
+      compiled.fields.append((name, format_spec == 'attr'))
+      compiled.literals.append('')
+  return compiled
+
+
+def render_html(
+  meta: AudioMetadata,
+  content_url: str,
+  cover_url: str,
+  gmt_now: str
+) -> bytes:
+  # same output as get_html, encoded as utf-8
+  return COMPILED_TEMPLATE.render(_template_fields(meta, content_url, cover_url, gmt_now))
+
+
+FORMATTER = HTMLFormatter()
+COMPILED_TEMPLATE = compile_template(TEMPLATE, {'THEME_COLOR': THEME_COLOR, 'PAGE_TITLE': PAGE_TITLE})